@@ -0,0 +1,58 @@
+import asyncio
+import pathlib
+import time
+
+from persistedstate import AsyncPersistedState, PersistedState
+
+TMP_FOLDER = pathlib.Path("tmp/asynctest")
+NUM_OF_ITEMS = 50_000
+CHANGES = 20_000
+TICK = 0.001
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+async def ticker(lags, stop):
+    # Measures how late the event loop runs a task scheduled every millisecond
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def measure(state_class):
+    file = TMP_FOLDER / "async.state"
+    file.unlink(missing_ok=True)
+    state = state_class(file)
+    state.items = [
+        {"id": index, "name": f"item #{index}"} for index in range(NUM_OF_ITEMS)
+    ]
+    state.counter = 0
+    lags = []
+    stop = asyncio.Event()
+    ticker_task = asyncio.create_task(ticker(lags, stop))
+    start = time.perf_counter()
+    for index in range(CHANGES):
+        state.counter += 1
+        if index % 100 == 0:
+            await asyncio.sleep(0)
+    duration = time.perf_counter() - start
+    stop.set()
+    await ticker_task
+    await asyncio.to_thread(state.close)
+    return duration, lags
+
+
+async def main():
+    print(f"{CHANGES} changes in a state of {NUM_OF_ITEMS} items, event loop lag")
+    print(f"{'Class':<20s} {'ops/sec':>9s} {'max lag ms':>11s}")
+    for state_class in [PersistedState, AsyncPersistedState]:
+        duration, lags = await measure(state_class)
+        print(
+            f"{state_class.__name__:<20s} {CHANGES / duration:9.0f}"
+            f" {max(lags, default=0) * 1000:11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+import pathlib
+import time
+
+from persistedstate import Follow, PersistedState
+
+TMP_FOLDER = pathlib.Path("tmp/followtest")
+NUM_OF_ITEMS = [1_000, 10_000, 50_000]
+CHANGES = 100
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+def measure(num_of_items):
+    file = TMP_FOLDER / "follow.state"
+    file.unlink(missing_ok=True)
+    with PersistedState(file, counter=0) as writer:
+        writer.items = [{"id": index} for index in range(num_of_items)]
+        writer.vacuum()
+        follower = PersistedState(file, _follow=Follow(milliseconds=60_000))
+        refresh_time = reopen_time = 0.0
+        for _ in range(CHANGES):
+            writer.counter += 1
+            start = time.perf_counter()
+            follower.refresh()
+            refresh_time += time.perf_counter() - start
+            assert follower.counter == writer.counter
+        for _ in range(CHANGES // 10):
+            writer.counter += 1
+            start = time.perf_counter()
+            with PersistedState(file, _follow=Follow(milliseconds=60_000)) as reopened:
+                assert reopened.counter == writer.counter
+            reopen_time += time.perf_counter() - start
+        follower.close()
+    return refresh_time / CHANGES, reopen_time / (CHANGES // 10)
+
+
+def main():
+    print("Time to see a change of the writer in milliseconds")
+    print(f"{'Items':>7s} {'refresh':>9s} {'reopen':>9s}")
+    for num_of_items in NUM_OF_ITEMS:
+        refresh_time, reopen_time = measure(num_of_items)
+        print(
+            f"{num_of_items:>7d} {refresh_time * 1000:9.3f} {reopen_time * 1000:9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import pathlib
+import shutil
+import time
+
+from persistedstate import PersistedState, VacuumPolicy
+
+TMP_FOLDER = pathlib.Path("tmp/journaltest")
+CHANGES = 50_000
+# No vacuum during the measurement, so the whole journal stays in the file
+NO_VACUUM = VacuumPolicy(
+    journal_ratio=float("inf"), replay_budget_milliseconds=float("inf")
+)
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+def increment_counter(state, index):
+    state.counter = index
+
+
+def update_item(state, index):
+    state.entries[index % 100]["status"] = f"done-{index}"
+
+
+WORKLOADS = {"counter": increment_counter, "nested item": update_item}
+
+
+def measure(journal_format, workload):
+    file = TMP_FOLDER / f"{journal_format}.state"
+    copy = TMP_FOLDER / f"{journal_format}-copy.state"
+    file.unlink(missing_ok=True)
+    with PersistedState(
+        file,
+        _journal_format=journal_format,
+        _vacuum_policy=NO_VACUUM,
+        counter=0,
+        entries=[{"id": index, "status": "new"} for index in range(100)],
+    ) as state:
+        state.vacuum()
+        snapshot_size = file.stat().st_size
+        start = time.perf_counter()
+        for index in range(CHANGES):
+            workload(state, index)
+        duration = time.perf_counter() - start
+        journal_bytes = file.stat().st_size - snapshot_size
+        shutil.copy(file, copy)  # the file as left behind by a crash
+    start = time.perf_counter()
+    PersistedState(copy, _journal_format=journal_format).close()
+    load_time = time.perf_counter() - start
+    return journal_bytes / CHANGES, CHANGES / duration, load_time
+
+
+def main():
+    print(f"{CHANGES} changes")
+    print(
+        f"{'Workload':<12s} {'Journal':<7s} {'bytes/op':>9s} {'ops/sec':>10s}"
+        f" {'load ms':>8s}"
+    )
+    for name, workload in WORKLOADS.items():
+        for journal_format in ("text", "binary"):
+            bytes_per_op, ops_per_second, load_time = measure(journal_format, workload)
+            print(
+                f"{name:<12s} {journal_format:<7s} {bytes_per_op:9.1f}"
+                f" {ops_per_second:10.0f} {load_time * 1000:8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
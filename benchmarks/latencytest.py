@@ -0,0 +1,43 @@
+import pathlib
+import statistics
+import time
+
+from persistedstate import PersistedState
+
+TMP_FOLDER = pathlib.Path("tmp/latencytest")
+STATE_SIZES = [1_000, 10_000, 50_000]
+CHANGES = 5_000
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+def measure_latencies(num_of_items, background_vacuum):
+    file = TMP_FOLDER / "latency.state"
+    file.unlink(missing_ok=True)
+    latencies = []
+    with PersistedState(file, _background_vacuum=background_vacuum) as state:
+        state.items = [{"id": index} for index in range(num_of_items)]
+        state.counter = 0
+        for _ in range(CHANGES):
+            start = time.perf_counter()
+            state.counter += 1
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    print(f"{CHANGES} changes, latency of a single change in microseconds")
+    print(f"{'Items':>7s} {'Vacuum':<12s} {'p50':>8s} {'p99':>8s} {'max':>10s}")
+    for num_of_items in STATE_SIZES:
+        for background_vacuum in [False, True]:
+            latencies = measure_latencies(num_of_items, background_vacuum)
+            percentiles = statistics.quantiles(latencies, n=100)
+            print(
+                f"{num_of_items:>7d} {'background' if background_vacuum else 'inline':<12s}"
+                f" {percentiles[49] * 1e6:8.1f} {percentiles[98] * 1e6:8.1f}"
+                f" {max(latencies) * 1e6:10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import pathlib
+import time
+import tracemalloc
+from collections.abc import Mapping, Sequence
+
+from persistedstate import PersistedState
+
+TMP_FOLDER = pathlib.Path("tmp/lazytest")
+NUM_OF_ITEMS = [1_000, 10_000, 50_000]
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+def wrap_all(value):
+    # Accessing every value wraps all nested objects, like loading did before
+    if isinstance(value, str):
+        return
+    if isinstance(value, Mapping):
+        for item in value.values():
+            wrap_all(item)
+    elif isinstance(value, Sequence):
+        for item in value:
+            wrap_all(item)
+
+
+def measure(file, eager):
+    start = time.perf_counter()
+    state = PersistedState(file)
+    _ = state.last_id
+    if eager:
+        wrap_all(state)
+    duration = time.perf_counter() - start
+    state.close()
+    # Tracing slows down the execution, so it is measured separately
+    tracemalloc.start()
+    state = PersistedState(file)
+    _ = state.last_id
+    if eager:
+        wrap_all(state)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    state.close()
+    return duration, memory
+
+
+def main():
+    print("Open a state and read a single value")
+    print(f"{'Items':>7s} {'Wrapping':<9s} {'sec':>7s} {'MB used':>9s}")
+    for num_of_items in NUM_OF_ITEMS:
+        file = TMP_FOLDER / "lazy.state"
+        file.unlink(missing_ok=True)
+        with PersistedState(file) as state:
+            state.items = [
+                {"id": index, "name": f"item #{index}", "tags": ["a", "b"]}
+                for index in range(num_of_items)
+            ]
+            state.last_id = num_of_items - 1
+        for eager in [True, False]:
+            duration, memory = measure(file, eager)
+            print(
+                f"{num_of_items:>7d} {'eager' if eager else 'lazy':<9s}"
+                f" {duration:7.3f} {memory / 1024 / 1024:9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
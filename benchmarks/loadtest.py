@@ -0,0 +1,66 @@
+import json
+import pathlib
+import time
+
+import yaml
+
+from persistedstate import PersistedState
+
+TMP_FOLDER = pathlib.Path("tmp/loadtest")
+JOURNAL_LENGTHS = [0, 100, 500, 1000, 2000, 5000]
+ITERATIONS = 5
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+def create_state_file(journal_length):
+    file = TMP_FOLDER / f"journal-{journal_length}.state"
+    snapshot = {
+        "counter": 0,
+        "items": [{"id": index, "name": f"item #{index}"} for index in range(100)],
+    }
+    records = [
+        "\n---\n" + json.dumps(["set", [], "counter", index + 1])
+        for index in range(journal_length)
+    ]
+    file.write_text(
+        yaml.safe_dump(snapshot, sort_keys=True) + "".join(records), encoding="utf-8"
+    )
+    return file
+
+
+def best_duration(function):
+    durations = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def load_with_yaml_parser(file):
+    with file.open(encoding="utf-8") as stream:
+        for _ in yaml.safe_load_all(stream):
+            pass
+
+
+def load_persisted_state(file):
+    state = PersistedState(file)
+    # Do not vacuum on close, so the journal is kept for the next iteration
+    state._MappedYaml__file_handler._FileHandler__file.close()
+
+
+def main():
+    print(f"{'Journal length':>14s} {'YAML parser':>12s} {'PersistedState':>15s}")
+    for journal_length in JOURNAL_LENGTHS:
+        file = create_state_file(journal_length)
+        yaml_duration = best_duration(lambda: load_with_yaml_parser(file))
+        state_duration = best_duration(lambda: load_persisted_state(file))
+        print(
+            f"{journal_length:>14d} {yaml_duration * 1000:9.1f} ms"
+            f" {state_duration * 1000:12.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
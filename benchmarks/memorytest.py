@@ -0,0 +1,31 @@
+import pathlib
+import tracemalloc
+
+from persistedstate import PersistedState
+
+TMP_FOLDER = pathlib.Path("tmp/memorytest")
+NUM_OF_ENTRIES = 10_000
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+def main():
+    file = TMP_FOLDER / "memory.state"
+    file.unlink(missing_ok=True)
+    with PersistedState(file) as state:
+        tracemalloc.start()
+        state.entries = [
+            {"id": index, "tags": ["a"]} for index in range(NUM_OF_ENTRIES)
+        ]
+        data_size, _ = tracemalloc.get_traced_memory()
+        for entry in state.entries:
+            _ = entry["tags"]  # The wrappers are kept in the state
+        wrapped_size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"{NUM_OF_ENTRIES} nested entries")
+    print(f"Data     {data_size / 1024 / 1024:6.2f} MB")
+    print(f"Wrappers {(wrapped_size - data_size) / 1024 / 1024:6.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
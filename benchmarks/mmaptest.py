@@ -0,0 +1,61 @@
+import gc
+import pathlib
+import time
+import tracemalloc
+
+from persistedstate import PersistedState
+from persistedstate.file_handler import FileHandler
+
+TMP_FOLDER = pathlib.Path("tmp/mmaptest")
+STATE_FILE = TMP_FOLDER / "large.state"
+TARGET_SIZE = 100 * 1024 * 1024
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+def write_state():
+    # Written directly, rendering 100 MB of YAML would take long
+    line_format = "- processed-item-{:064d}\n"
+    count = TARGET_SIZE // len(line_format.format(0))
+    with STATE_FILE.open("w", encoding="utf-8") as file:
+        file.write("counter: 0\nprocessed_items:\n")
+        for index in range(count):
+            file.write(line_format.format(index))
+        file.write('---\n["set", [], "counter", 1]')
+    return count
+
+
+def measure(mmap_threshold):
+    original_threshold = FileHandler._MMAP_THRESHOLD
+    FileHandler._MMAP_THRESHOLD = mmap_threshold
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        state = PersistedState(STATE_FILE)
+        duration = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        FileHandler._MMAP_THRESHOLD = original_threshold
+    assert state.counter == 1
+    # Closing would vacuum (rewrite) the file
+    state._MappedYaml__file_handler._FileHandler__file.close()
+    return duration, current, peak
+
+
+def main():
+    count = write_state()
+    size = STATE_FILE.stat().st_size
+    print(f"Loading {size / 1024 / 1024:.0f} MB state of {count} items")
+    print(f"{'Load':<6s} {'seconds':>8s} {'state MB':>9s} {'peak MB':>8s}")
+    for name, threshold in [("read", float("inf")), ("mmap", 1024 * 1024)]:
+        duration, current, peak = measure(threshold)
+        print(
+            f"{name:<6s} {duration:8.1f} {current / 1024 / 1024:9.0f}"
+            f" {peak / 1024 / 1024:8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ from diskcache import Cache
 from lmdbm import Lmdb
 from sqlitedict import SqliteDict
 
-from persistedstate import PersistedState
+from persistedstate import FsyncEvery, FsyncInterval, PersistedState
 
 COUNT_TO = 10_000
 TMP_FOLDER = pathlib.Path("tmp/perftest")
@@ -32,24 +32,42 @@ class BaseTest:
             end = time.perf_counter()
             duration = end - start
             STATE[test_name].append(duration)
-        print(f"{test_name:<15s} {duration:6.3f} sec")
+        print_result(test_name, duration)
 
     def print_best_result(self):
         test_name = self.__class__.__name__.replace("Test", "")
         duration = min(STATE[test_name])
-        print(f"{test_name:<15s} {duration:6.3f} sec")
+        print_result(test_name, duration)
+
+
+def print_result(test_name, duration):
+    print(f"{test_name:<29s} {duration:6.3f} sec {COUNT_TO / duration:10,.0f} ops/sec")
 
 
 class PersistedStateTest(BaseTest):
+    durability = "flush"
+
     def do_the_count(self):
         file = TMP_FOLDER / "persisted.state"
         file.unlink(missing_ok=True)
-        with PersistedState(file) as state:
+        with PersistedState(file, _durability=self.durability) as state:
             state.counter = 0
             for _ in range(COUNT_TO):
                 state.counter += 1
 
 
+class PersistedStateFsyncTest(PersistedStateTest):
+    durability = "fsync"
+
+
+class PersistedStateFsyncEvery100Test(PersistedStateTest):
+    durability = FsyncEvery(100)
+
+
+class PersistedStateFsyncInterval50msTest(PersistedStateTest):
+    durability = FsyncInterval(50)
+
+
 class BaseDictTest(BaseTest):
     def do_the_count(self):
         self.dict["counter"] = 0
@@ -87,6 +105,9 @@ class LmdbTest(BaseDictTest):
 
 TEST_CLASSES = [
     PersistedStateTest,
+    PersistedStateFsyncTest,
+    PersistedStateFsyncEvery100Test,
+    PersistedStateFsyncInterval50msTest,
     DiskCacheTest,
     SqliteDictTest,
     LmdbTest,
@@ -95,7 +116,8 @@ TEST_CLASSES = [
 
 
 def main():
-    STATE.pop("PersistedState", None)
+    for test_name in [name for name in STATE if name.startswith("PersistedState")]:
+        STATE.pop(test_name)
     print(f"Counting to {COUNT_TO}")
     for iteration in range(ITERATIONS):
         print(f"\nIteration #{iteration}\n")
@@ -0,0 +1,39 @@
+import pathlib
+import time
+
+from persistedstate import PersistedState
+
+TMP_FOLDER = pathlib.Path("tmp/queuetest")
+QUEUE_LENGTHS = [1_000, 5_000, 20_000]
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+def measure(queue_length):
+    file = TMP_FOLDER / "queue.state"
+    file.unlink(missing_ok=True)
+    with PersistedState(file, queue=[]) as state:
+        start = time.perf_counter()
+        for index in range(queue_length):
+            state.queue.append({"id": index, "payload": {"tags": ["a", "b"]}})
+        enqueued = time.perf_counter()
+        while state.queue:
+            state.queue[0]["payload"]["tags"].append("done")
+            del state.queue[0]
+        dequeued = time.perf_counter()
+    return enqueued - start, dequeued - enqueued
+
+
+def main():
+    print("FIFO queue of nested dicts: append all, then update and pop from the head")
+    print(f"{'Length':>7s} {'enqueue/sec':>12s} {'dequeue/sec':>12s}")
+    for queue_length in QUEUE_LENGTHS:
+        enqueue, dequeue = measure(queue_length)
+        print(
+            f"{queue_length:>7d} {queue_length / enqueue:12.0f}"
+            f" {queue_length / dequeue:12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
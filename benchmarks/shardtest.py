@@ -0,0 +1,72 @@
+import pathlib
+import shutil
+import time
+
+from persistedstate import PersistedState, ShardedPersistedState
+from persistedstate.file_handler import FileHandler
+
+TMP_FOLDER = pathlib.Path("tmp/shardtest")
+PROCESSED_ITEMS = 300_000  # about 10 MB of YAML
+CHANGES = 20_000
+
+
+def timed_vacuums(function):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            wrapper.count += 1
+            wrapper.seconds += time.perf_counter() - start
+
+    wrapper.count = 0
+    wrapper.seconds = 0.0
+    return wrapper
+
+
+def open_single():
+    return PersistedState(TMP_FOLDER / "single.state")
+
+
+def open_sharded():
+    return ShardedPersistedState(TMP_FOLDER / "sharded")
+
+
+def measure(open_state):
+    shutil.rmtree(TMP_FOLDER, ignore_errors=True)
+    TMP_FOLDER.mkdir(parents=True)
+    original_vacuum = FileHandler.vacuum
+    FileHandler.vacuum = timed_vacuums(original_vacuum)
+    try:
+        with open_state() as state:
+            state.processed_items = [
+                f"item-{index:032d}" for index in range(PROCESSED_ITEMS)
+            ]
+            state.counter = 0
+            state.vacuum()
+            FileHandler.vacuum.count = 0
+            FileHandler.vacuum.seconds = 0.0
+            start = time.perf_counter()
+            for _ in range(CHANGES):
+                state.counter += 1
+            duration = time.perf_counter() - start
+            vacuums = FileHandler.vacuum.count
+            vacuum_seconds = FileHandler.vacuum.seconds
+    finally:
+        FileHandler.vacuum = original_vacuum
+    return duration, vacuums, vacuum_seconds
+
+
+def main():
+    print(f"{CHANGES} changes of a counter next to {PROCESSED_ITEMS} processed items")
+    print(f"{'State':<8s} {'ops/sec':>10s} {'vacuums':>8s} {'vacuum ms':>10s}")
+    for name, open_state in [("single", open_single), ("sharded", open_sharded)]:
+        duration, vacuums, vacuum_seconds = measure(open_state)
+        print(
+            f"{name:<8s} {CHANGES / duration:10.0f} {vacuums:8d}"
+            f" {vacuum_seconds * 1000:10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
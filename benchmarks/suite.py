@@ -0,0 +1,429 @@
+import argparse
+import concurrent.futures
+import json
+import pathlib
+import platform
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+
+from persistedstate import BlobStore, PersistedState, VacuumPolicy, WriterThread
+from persistedstate.types import convert_to_json_like
+
+TMP_FOLDER = pathlib.Path("tmp/benchmarks")
+DEFAULT_RESULTS = TMP_FOLDER / "results.json"
+DEFAULT_BASELINE = TMP_FOLDER / "baseline.json"
+# Keep the whole journal in the file, to measure its growth
+NO_VACUUM = VacuumPolicy(
+    journal_ratio=float("inf"), replay_budget_milliseconds=float("inf")
+)
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+# The metrics ending with "ops_per_sec" are better when higher, the others when lower
+def higher_is_better(metric):
+    return metric.endswith("ops_per_sec")
+
+
+def new_file(name):
+    file = TMP_FOLDER / f"{name}.state"
+    file.unlink(missing_ok=True)
+    return file
+
+
+def close_without_vacuum(state):
+    state._MappedYaml__file_handler._FileHandler__file.close()
+
+
+def counter_increment():
+    changes = 10_000
+    file = new_file("counter")
+    with PersistedState(file, _vacuum_policy=NO_VACUUM, counter=0) as state:
+        state.vacuum()
+        snapshot_size = file.stat().st_size
+        start = time.perf_counter()
+        for _ in range(changes):
+            state.counter += 1
+        duration = time.perf_counter() - start
+        growth = file.stat().st_size - snapshot_size
+    return {
+        "ops_per_sec": changes / duration,
+        "bytes_per_op": growth / changes,
+    }
+
+
+def nested_dict_update():
+    changes = 10_000
+    file = new_file("nested")
+    with PersistedState(
+        file,
+        _vacuum_policy=NO_VACUUM,
+        config={f"section{i}": {f"key{j}": 0 for j in range(10)} for i in range(10)},
+    ) as state:
+        state.vacuum()
+        snapshot_size = file.stat().st_size
+        start = time.perf_counter()
+        for index in range(changes):
+            state.config[f"section{index % 10}"][f"key{index % 7}"] = index
+        duration = time.perf_counter() - start
+        growth = file.stat().st_size - snapshot_size
+    return {
+        "ops_per_sec": changes / duration,
+        "bytes_per_op": growth / changes,
+    }
+
+
+def list_append_and_fifo_pop():
+    changes = 10_000
+    with PersistedState(new_file("fifo"), queue=[]) as state:
+        start = time.perf_counter()
+        for index in range(changes):
+            state.queue.append({"id": index})
+        append_duration = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(changes):
+            state.queue.pop(0)
+        pop_duration = time.perf_counter() - start
+    return {
+        "append_ops_per_sec": changes / append_duration,
+        "pop_ops_per_sec": changes / pop_duration,
+    }
+
+
+def bulk_operations():
+    items = 10_000
+    file = new_file("bulk")
+    with PersistedState(file, _vacuum_policy=NO_VACUUM, list=[], config={}) as state:
+        state.vacuum()
+        snapshot_size = file.stat().st_size
+        start = time.perf_counter()
+        state.list.extend({"id": index} for index in range(items))
+        state.config.update((f"key{index}", index) for index in range(items))
+        del state.list[: items // 2]
+        duration = time.perf_counter() - start
+        growth = file.stat().st_size - snapshot_size
+    return {"seconds": duration, "journal_bytes": growth}
+
+
+def large_value_set():
+    changes = 20
+    # About 1 MB of JSON
+    value = {
+        f"group{group}": [
+            {"id": index, "name": f"item #{index}", "tags": ["a", "b"], "size": 1.5}
+            for index in range(100)
+        ]
+        for group in range(130)
+    }
+    with PersistedState(
+        new_file("large"), _vacuum_policy=NO_VACUUM, value=None, copy=None
+    ) as state:
+        start = time.perf_counter()
+        for _ in range(changes):
+            state.value = value
+        new_duration = time.perf_counter() - start
+        for group in state.value.values():  # wrap the nested values
+            for item in group:
+                item["size"] = 2.5
+        start = time.perf_counter()
+        for _ in range(changes):
+            state.copy = state.value
+        wrapped_duration = time.perf_counter() - start
+    return {
+        "new_value_seconds": new_duration / changes,
+        "wrapped_value_seconds": wrapped_duration / changes,
+    }
+
+
+def create_state_file(name, num_of_items, journal_length):
+    file = new_file(name)
+    with PersistedState(
+        file,
+        _vacuum_policy=NO_VACUUM,
+        counter=0,
+        items=[
+            {"id": index, "name": f"item #{index}"} for index in range(num_of_items)
+        ],
+    ) as state:
+        state.vacuum()
+        for _ in range(journal_length):
+            state.counter += 1
+        shutil.copy(file, TMP_FOLDER / f"{name}.copy")  # before the vacuum on close
+    return TMP_FOLDER / f"{name}.copy"
+
+
+def load_time():
+    results = {}
+    for num_of_items, journal_length in [
+        (100, 0),
+        (100, 10_000),
+        (100, 100_000),
+        (10_000, 0),
+        (100_000, 0),
+    ]:
+        file = create_state_file("load", num_of_items, journal_length)
+        start = time.perf_counter()
+        state = PersistedState(file)
+        duration = time.perf_counter() - start
+        close_without_vacuum(state)
+        results[f"items_{num_of_items}_journal_{journal_length}_seconds"] = duration
+    return results
+
+
+def checkpoint_load():
+    file = new_file("checkpoint")
+    with PersistedState(
+        file,
+        _checkpoint=True,
+        items=[{"id": index, "name": f"item #{index}"} for index in range(100_000)],
+    ):
+        pass
+    results = {"file_mb": file.stat().st_size / 1024 / 1024}
+    for name, options in [("yaml", {}), ("checkpoint", {"_checkpoint": True})]:
+        start = time.perf_counter()
+        state = PersistedState(file, **options)
+        results[f"{name}_seconds"] = time.perf_counter() - start
+        close_without_vacuum(state)
+    return results
+
+
+def vacuum_time_and_memory():
+    file = create_state_file("vacuum", 100_000, 0)
+    with PersistedState(file) as state:
+        start = time.perf_counter()
+        state.vacuum()
+        duration = time.perf_counter() - start
+        # Tracing slows down the vacuum, it is measured separately
+        tracemalloc.start()
+        try:
+            state.vacuum()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"seconds": duration, "peak_mb": peak / 1024 / 1024}
+
+
+def blob_vacuum():
+    # 50 documents of 1 MB, stored inline or in the blob store
+    documents = [f"document {index}\n" * 80_000 for index in range(50)]
+    results = {}
+    for name, options in [("inline", {}), ("blobs", {"_blob_store": BlobStore()})]:
+        file = new_file(f"blobs_{name}")
+        with PersistedState(file, _vacuum_policy=NO_VACUUM, **options) as state:
+            for index, document in enumerate(documents):
+                state[f"document{index}"] = document
+            start = time.perf_counter()
+            state.vacuum()
+            results[f"{name}_vacuum_seconds"] = time.perf_counter() - start
+            results[f"{name}_file_mb"] = file.stat().st_size / 1024 / 1024
+    return results
+
+
+def snapshot_read():
+    # A thread exports the state repeatedly, while the main thread changes it
+    file = create_state_file("snapshot", 100_000, 0)
+    results = {}
+    with PersistedState(file, _vacuum_policy=NO_VACUUM) as state:
+        start = time.perf_counter()
+        state.snapshot()
+        results["snapshot_seconds"] = time.perf_counter() - start
+
+        def export_locked():
+            with state._thread_lock:
+                return convert_to_json_like(state)
+
+        def export_snapshot():
+            return convert_to_json_like(state.snapshot())
+
+        for name, export in [("locked", export_locked), ("snapshot", export_snapshot)]:
+            stop = threading.Event()
+
+            def export_until_stopped(export=export, stop=stop):
+                while not stop.is_set():
+                    export()
+
+            exporter = threading.Thread(target=export_until_stopped)
+            exporter.start()
+            changes = 2000
+            start = time.perf_counter()
+            for index in range(changes):
+                state.counter = index
+            duration = time.perf_counter() - start
+            stop.set()
+            exporter.join()
+            results[f"changes_during_{name}_export_ops_per_sec"] = changes / duration
+    return results
+
+
+def thread_contention():
+    num_of_threads = 100
+    steps_of_each_thread = 100
+    with PersistedState(new_file("threads"), list=[]) as state:
+
+        def append_items():
+            for index in range(steps_of_each_thread):
+                state.list.append(index)
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=num_of_threads
+        ) as executor:
+            for future in [
+                executor.submit(append_items) for _ in range(num_of_threads)
+            ]:
+                future.result()
+        duration = time.perf_counter() - start
+    return {"ops_per_sec": num_of_threads * steps_of_each_thread / duration}
+
+
+# The options of the writing modes, and their number of changes: with "fsync"
+# every change waits for a sync
+WRITING_MODES = {
+    "inline": ({}, 20_000),
+    "writer_thread": ({"_writer_thread": True}, 20_000),
+    "inline_fsync": ({"_durability": "fsync"}, 2_000),
+    "writer_fsync_wait": (
+        {"_durability": "fsync", "_writer_thread": WriterThread(wait=True)},
+        2_000,
+    ),
+}
+
+
+def writing_modes():
+    # Threads setting their own key, in every writing mode
+    results = {}
+    for mode, (options, changes) in WRITING_MODES.items():
+        for num_of_threads in [1, 8, 100]:
+            keys = [f"thread{index}" for index in range(num_of_threads)]
+            with PersistedState(
+                new_file(f"writing_{mode}"), **options, **dict.fromkeys(keys, 0)
+            ) as state:
+
+                def set_key(key):
+                    for step in range(changes // num_of_threads):
+                        state[key] = step
+
+                start = time.perf_counter()
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=num_of_threads
+                ) as executor:
+                    for future in [executor.submit(set_key, key) for key in keys]:
+                        future.result()
+                state.flush()
+                duration = time.perf_counter() - start
+            metric = f"{mode}_{num_of_threads}_threads_ops_per_sec"
+            results[metric] = changes / duration
+    return results
+
+
+SCENARIOS = {
+    "counter_increment": counter_increment,
+    "nested_dict_update": nested_dict_update,
+    "list_append_and_fifo_pop": list_append_and_fifo_pop,
+    "bulk_operations": bulk_operations,
+    "large_value_set": large_value_set,
+    "load_time": load_time,
+    "vacuum": vacuum_time_and_memory,
+    "checkpoint_load": checkpoint_load,
+    "blob_vacuum": blob_vacuum,
+    "snapshot_read": snapshot_read,
+    "thread_contention": thread_contention,
+    "writing_modes": writing_modes,
+}
+
+
+def run_scenario(function, repeat):
+    # The best of the repetitions, the others were disturbed by something
+    best = {}
+    for _ in range(repeat):
+        for metric, value in function().items():
+            if metric not in best:
+                best[metric] = value
+            elif higher_is_better(metric):
+                best[metric] = max(best[metric], value)
+            else:
+                best[metric] = min(best[metric], value)
+    return best
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"\n{'Metric':<58s} {'baseline':>12s} {'current':>12s} {'change':>8s}")
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            base_value = baseline.get(scenario, {}).get(metric)
+            if not base_value:
+                continue
+            change = value / base_value - 1
+            worse = -change if higher_is_better(metric) else change
+            flag = ""
+            if worse > threshold:
+                flag = " REGRESSION"
+                regressions.append(f"{scenario}.{metric}")
+            print(
+                f"{scenario + '.' + metric:<58s} {base_value:12.4g} {value:12.4g}"
+                f" {change:+8.1%}{flag}"
+            )
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark suite of persistedstate")
+    parser.add_argument(
+        "scenarios", nargs="*", help=f"run only these: {', '.join(SCENARIOS)}"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=pathlib.Path, default=DEFAULT_RESULTS)
+    parser.add_argument("--baseline", type=pathlib.Path, default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative change of a metric reported as a regression",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the results as the baseline of the next runs",
+    )
+    arguments = parser.parse_args()
+    unknown = set(arguments.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+    return arguments
+
+
+def main():
+    arguments = parse_arguments()
+    results = {}
+    for name in arguments.scenarios or SCENARIOS:
+        results[name] = run_scenario(SCENARIOS[name], arguments.repeat)
+        for metric, value in results[name].items():
+            print(f"{name + '.' + metric:<58s} {value:12.4g}")
+    document = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    arguments.output.parent.mkdir(parents=True, exist_ok=True)
+    arguments.output.write_text(json.dumps(document, indent=2), encoding="utf-8")
+    if arguments.save_baseline:
+        shutil.copy(arguments.output, arguments.baseline)
+        print(f"\nBaseline saved to {arguments.baseline}")
+        return 0
+    if not arguments.baseline.exists():
+        print(f"\nNo baseline at {arguments.baseline}, use --save-baseline")
+        return 0
+    baseline = json.loads(arguments.baseline.read_text(encoding="utf-8"))
+    regressions = compare(results, baseline["results"], arguments.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import pathlib
+import shutil
+import time
+
+from persistedstate import PersistedState, VacuumPolicy
+from persistedstate.file_handler import FileHandler
+
+TMP_FOLDER = pathlib.Path("tmp/vacuumpolicy")
+STATE_SIZES = [100, 10_000, 100_000]
+CHANGES = 20_000
+POLICIES = {
+    # Emulates the former fixed trigger of a vacuum after every 2000 changes
+    "2000 changes": VacuumPolicy(
+        journal_ratio=float("inf"),
+        replay_budget_milliseconds=2000 * FileHandler._DEFAULT_REPLAY_SECONDS * 1000,
+    ),
+    "default": VacuumPolicy(),
+}
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+def count_vacuums(function):
+    def wrapper(*args, **kwargs):
+        wrapper.count += 1
+        return function(*args, **kwargs)
+
+    wrapper.count = 0
+    return wrapper
+
+
+def measure(num_of_items, policy):
+    file = TMP_FOLDER / "policy.state"
+    copy = TMP_FOLDER / "policy-copy.state"
+    file.unlink(missing_ok=True)
+    original_vacuum = FileHandler.vacuum
+    FileHandler.vacuum = count_vacuums(original_vacuum)
+    try:
+        with PersistedState(file, _vacuum_policy=policy) as state:
+            state.items = [{"id": index} for index in range(num_of_items)]
+            state.counter = 0
+            state.vacuum()
+            snapshot_size = file.stat().st_size
+            FileHandler.vacuum.count = 0
+            start = time.perf_counter()
+            for _ in range(CHANGES):
+                state.counter += 1
+            duration = time.perf_counter() - start
+            vacuums = FileHandler.vacuum.count
+            shutil.copy(file, copy)  # the file as left behind by a crash
+    finally:
+        FileHandler.vacuum = original_vacuum
+    start = time.perf_counter()
+    PersistedState(copy).close()
+    load_time = time.perf_counter() - start
+    journal_bytes = len(f'\n---\n["set", ["counter"], {CHANGES}]') * CHANGES
+    amplification = (journal_bytes + vacuums * snapshot_size) / journal_bytes
+    return duration, vacuums, amplification, load_time
+
+
+def main():
+    print(f"{CHANGES} changes of a counter")
+    print(
+        f"{'Items':>7s} {'Policy':<14s} {'ops/sec':>10s} {'vacuums':>8s}"
+        f" {'write amp.':>10s} {'load ms':>8s}"
+    )
+    for num_of_items in STATE_SIZES:
+        for name, policy in POLICIES.items():
+            duration, vacuums, amplification, load_time = measure(num_of_items, policy)
+            print(
+                f"{num_of_items:>7d} {name:<14s} {CHANGES / duration:10.0f} {vacuums:8d}"
+                f" {amplification:10.1f} {load_time * 1000:8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import pathlib
+import time
+import tracemalloc
+
+import yaml
+
+from persistedstate import PersistedState
+from persistedstate.types import convert_to_json_like
+
+TMP_FOLDER = pathlib.Path("tmp/vacuumtest")
+NUM_OF_ITEMS = 50_000
+
+TMP_FOLDER.mkdir(parents=True, exist_ok=True)
+
+
+def measure(function):
+    start = time.perf_counter()
+    function()
+    duration = time.perf_counter() - start
+    # Tracing slows down the execution, so it is measured separately
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak
+
+
+def copy_and_dump(state):
+    # The way vacuum worked before: plain copy, render into a string, write it
+    yaml_str = yaml.dump(
+        convert_to_json_like(state),
+        Dumper=yaml.CSafeDumper if yaml.__with_libyaml__ else yaml.SafeDumper,
+        allow_unicode=True,
+        sort_keys=True,
+    ).encode("utf-8")
+    (TMP_FOLDER / "copy.yaml").write_bytes(yaml_str)
+
+
+def main():
+    file = TMP_FOLDER / "vacuum.state"
+    file.unlink(missing_ok=True)
+    with PersistedState(file) as state:
+        state.items = [
+            {"id": index, "name": f"item #{index}", "tags": ["a", "b"]}
+            for index in range(NUM_OF_ITEMS)
+        ]
+        state.vacuum()
+        print(f"State file size: {file.stat().st_size / 1024 / 1024:.1f} MB")
+        for name, function in [
+            ("Copy and dump", lambda: copy_and_dump(state)),
+            ("Vacuum", state.vacuum),
+        ]:
+            duration, peak = measure(function)
+            print(
+                f"{name:<15s} {duration:6.3f} sec"
+                f" {peak / 1024 / 1024:8.1f} MB peak memory"
+            )
+
+
+if __name__ == "__main__":
+    main()
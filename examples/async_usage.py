@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+import asyncio
+
+from persistedstate import AsyncPersistedState
+
+
+async def main():
+    async with await AsyncPersistedState.open(
+        "tmp/async_example.state", last_id=0
+    ) as state:
+        for current_id in range(state.last_id + 1, 100_001):
+            print(f"Processing #{current_id}")
+            state.last_id = current_id
+            if current_id % 1000 == 0:
+                await state.acommit()
+    print("Processing DONE.")
+
+
+asyncio.run(main())
@@ -1,3 +1,25 @@
+from persistedstate.aio import AsyncPersistedState
 from persistedstate.core import PersistedState
+from persistedstate.options import (
+    BlobStore,
+    Follow,
+    FsyncEvery,
+    FsyncInterval,
+    VacuumPolicy,
+    WriteBehind,
+    WriterThread,
+)
+from persistedstate.sharded import ShardedPersistedState
 
-__all__ = ["PersistedState"]
+__all__ = [
+    "AsyncPersistedState",
+    "BlobStore",
+    "Follow",
+    "FsyncEvery",
+    "FsyncInterval",
+    "PersistedState",
+    "ShardedPersistedState",
+    "VacuumPolicy",
+    "WriteBehind",
+    "WriterThread",
+]
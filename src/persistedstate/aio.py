@@ -0,0 +1,40 @@
+import asyncio
+import os
+from typing import Union
+
+from persistedstate.core import PersistedState
+
+
+class AsyncPersistedState(PersistedState):
+    # Changes are applied in memory immediately, and written by a writer thread,
+    # so the event loop is not blocked by writing, syncing or vacuuming the file.
+    # The awaitable methods are prefixed with "a", the inherited ones block.
+    def __init__(self, _filepath: Union[str, os.PathLike], **defaults):
+        super().__init__(_filepath, _writer_thread=True, **defaults)
+
+    @classmethod
+    async def open(cls, _filepath: Union[str, os.PathLike], **defaults):
+        # Loads the file in another thread, not in the event loop
+        return await asyncio.to_thread(cls, _filepath, **defaults)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        await asyncio.to_thread(self.close)
+
+    async def acommit(self):
+        await self.__barrier(durable=True)
+
+    async def aflush(self):
+        await self.__barrier()
+
+    async def avacuum(self):
+        await self.__barrier(vacuum=True)
+
+    async def __barrier(self, **kwargs):
+        file_handler = self._MappedYaml__file_handler  # pylint: disable=no-member
+        await asyncio.wrap_future(file_handler.barrier(**kwargs))
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import pathlib
+import re
+import time
+from typing import Any, Optional
+
+from persistedstate.types import BLOB_KEY, BlobReference, YamlDict, YamlList
+
+# Appended to the name of the state file. A string stored out of line is a file
+# in this directory named by the hash of its content, and the state contains a
+# reference {"$blob": "<sha256>"} to it.
+BLOBS_SUFFIX = ".blobs"
+# The empty file next to a blob found unreferenced, its time is when it was found
+_UNREFERENCED_SUFFIX = ".unreferenced"
+
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+def blob_digest(value: Any) -> Optional[str]:
+    # The digest if the value is a blob reference. It is also a file name, so
+    # anything else (e.g. "../name") is not a reference.
+    if not isinstance(value, dict) or len(value) != 1:
+        return None
+    digest = value.get(BLOB_KEY)
+    if isinstance(digest, str) and _DIGEST.fullmatch(digest):
+        return digest
+    return None
+
+
+def store_blob(
+    directory: pathlib.Path, text: str, durable: bool
+) -> tuple[BlobReference, bool]:
+    # The reference, and whether a new file was written (the same content is
+    # stored once). The caller syncs the directory of a new durable file.
+    data = text.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    path = directory / digest
+    if path.exists():
+        return BlobReference({BLOB_KEY: digest}), False
+    directory.mkdir(exist_ok=True)
+    temp_path = directory / (digest + ".tmp")
+    with temp_path.open("wb") as file:
+        file.write(data)
+        if durable:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return BlobReference({BLOB_KEY: digest}), True
+
+
+def read_blob(directory: pathlib.Path, digest: str) -> str:
+    return (directory / digest).read_bytes().decode("utf-8")
+
+
+def blob_references(value: Any) -> set[str]:
+    # The digests referenced by the state, this only walks the dicts and lists
+    found: set[str] = set()
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, YamlDict):
+            # A reference is not wrapped, but keeping a blob is harmless
+            value = value._YamlDict__cache
+            digest = blob_digest(value)
+            if digest is not None:
+                found.add(digest)
+                continue
+            items = value.values()
+        elif isinstance(value, YamlList):
+            items = value._YamlList__cache
+        elif isinstance(value, list):
+            items = value
+        else:
+            digest = blob_digest(value)
+            if digest is not None:
+                found.add(digest)
+                continue
+            items = value.values()
+        stack.extend(item for item in items if _is_container(item))
+    return found
+
+
+def remove_unreferenced_blobs(
+    directory: pathlib.Path, referenced: set[str], grace_seconds: float
+) -> int:
+    # Removes the blobs found unreferenced at least grace_seconds ago, the
+    # temporary files of interrupted writes, and the directory when it is empty.
+    # Returns the number of removed blobs.
+    with os.scandir(directory) as entries:
+        names = {entry.name for entry in entries}
+    found_before = time.time() - grace_seconds
+    removed = 0
+    remaining = 0
+    for name in names:
+        marker = name + _UNREFERENCED_SUFFIX
+        if name.endswith(_UNREFERENCED_SUFFIX):
+            if name.removesuffix(_UNREFERENCED_SUFFIX) in names:
+                continue  # handled with its blob
+        elif name in referenced:
+            remaining += 1
+            if marker in names:  # referenced again
+                os.unlink(directory / marker)
+            continue
+        elif _DIGEST.fullmatch(name):
+            if grace_seconds > 0 and marker not in names:
+                (directory / marker).touch()
+                remaining += 1
+                continue
+            if marker in names:
+                if (directory / marker).stat().st_mtime > found_before:
+                    remaining += 1
+                    continue
+                os.unlink(directory / marker)
+            removed += 1
+        os.unlink(directory / name)
+    if not remaining:
+        os.rmdir(directory)
+    return removed
+
+
+def _is_container(value):
+    return isinstance(value, (dict, list, YamlDict, YamlList))
@@ -9,10 +9,10 @@ logger = logging.getLogger(__name__)
 
 
 class MappedYaml(YamlDict):
-    def __init__(self, _filepath: Union[str, os.PathLike]):
-        self.__file_handler = FileHandler(self, _filepath)
+    def __init__(self, _filepath: Union[str, os.PathLike], **options):
+        self.__file_handler = FileHandler(self, _filepath, **options)
         self._thread_lock = self.__file_handler.lock
-        super().__init__(self.__file_handler, [], {})
+        super().__init__(self.__file_handler, None, None, {})
         self.__file_handler.load()
 
     def __enter__(self):
@@ -24,22 +24,36 @@ class MappedYaml(YamlDict):
     def close(self):
         self.__file_handler.close()
 
-    def __del__(self):
-        self.__file_handler.close(do_logging=False)
+    def transaction(self):
+        return self.__file_handler.transaction()
 
+    def flush(self):
+        self.__file_handler.flush()
 
-class PersistedState(MappedYaml):
-    def __init__(self, _filepath: Union[str, os.PathLike], **defaults):
-        super().__init__(_filepath)
-        for key, value in defaults.items():
-            new_value = self.setdefault(key, value)
-            if logger.isEnabledFor(SPAM_LOG):
-                if value == new_value:
-                    verb = "IS"
-                else:
-                    verb = "isn't"
-                logger.log(SPAM_LOG, f"Default value {verb} set: {key} = {value}")
+    def vacuum(self):
+        self.__file_handler.vacuum()
+
+    def refresh(self):
+        return self.__file_handler.refresh()
+
+    def wait_for_change(self, timeout=None):
+        return self.__file_handler.wait_for_change(timeout)
+
+    def snapshot(self):
+        return self.__file_handler.snapshot()
+
+    def _stats(self):
+        return self.__file_handler.stats()
 
+    def __del__(self):
+        if (
+            "_MappedYaml__file_handler" in self.__dict__
+        ):  # The constructor may have failed
+            self.__file_handler.close(do_logging=False)
+
+
+class AttributeAccess:
+    # Top-level keys are accessible as attributes, Python attributes start with "_"
     def __getattr__(self, __name):
         try:
             return self[__name]
@@ -55,3 +69,20 @@ class PersistedState(MappedYaml):
                 logger.log(SPAM_LOG, f"Setting Python attribute {__name} = {__value}")
             return
         self[__name] = __value
+
+
+class PersistedState(AttributeAccess, MappedYaml):
+    def __init__(self, _filepath: Union[str, os.PathLike], **defaults):
+        # Options are prefixed with underscore, so they cannot collide with defaults
+        options = {
+            key[1:]: defaults.pop(key) for key in list(defaults) if key.startswith("_")
+        }
+        super().__init__(_filepath, **options)
+        for key, value in defaults.items():
+            new_value = self.setdefault(key, value)
+            if logger.isEnabledFor(SPAM_LOG):
+                if value == new_value:
+                    verb = "IS"
+                else:
+                    verb = "isn't"
+                logger.log(SPAM_LOG, f"Default value {verb} set: {key} = {value}")
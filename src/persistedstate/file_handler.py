@@ -1,102 +1,1077 @@
+import contextlib
+import functools
+import hashlib
+import itertools
 import json
 import logging
+import marshal
+import mmap
+import operator
+import os
 import pathlib
+import queue
+import re
+import struct
+import threading
+import time
+import weakref
+from concurrent.futures import Future
 from threading import RLock
+from typing import NamedTuple
 
-import yaml
-
+from persistedstate.blobs import (
+    BLOBS_SUFFIX,
+    blob_digest,
+    blob_references,
+    read_blob,
+    remove_unreferenced_blobs,
+    store_blob,
+)
+from persistedstate.journal import (
+    BINARY_JOURNAL,
+    GENERATION_MARKER,
+    INCOMPLETE_STATE,
+    LAST_VALID_STATE,
+    SEPARATOR,
+    complete_records_end,
+    dump_yaml,
+    encode_binary_batch,
+    encode_binary_record,
+    encode_text_record,
+    encode_value,
+    frame_binary_record,
+    parse_binary_records,
+    parse_documents,
+    read_generation,
+    yaml_dumper,
+    yaml_loader,
+)
+from persistedstate.options import (
+    BlobStore,
+    Follow,
+    FsyncEvery,
+    FsyncInterval,
+    VacuumPolicy,
+    WriteBehind,
+    WriterThread,
+)
+from persistedstate.stats import Stats, TimedLock
 from persistedstate.types import (
-    CustomJsonEncoder,
     YamlDict,
     YamlList,
-    convert_to_json_like,
+    clear_for_reload,
+    copy_live_snapshots,
+    copy_snapshot,
+    escape_value,
+    node_path,
+    refill_after_reload,
+    removed_elsewhere,
+    take_snapshot,
+    unescape,
+    unwrap,
 )
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
 logger = logging.getLogger(__name__)
 
 SPAM_LOG = 5
 
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# Appended to the name of the state file. The checkpoint is a header (version,
+# snapshot size, snapshot digest) and the marshaled snapshot.
+CHECKPOINT_SUFFIX = ".checkpoint"
+_CHECKPOINT_HEADER = struct.Struct("<IQ16s")
+_CHECKPOINT_VERSION = 1
+
+# Records with only these arguments besides the path are serialized by the writer
+# thread, because they cannot change after being queued
+_SCALARS = (str, int, float, type(None))
+
+# Found in the JSON of a value if one of its dicts may need to be escaped
+_ESCAPED_KEY_TEXT = re.compile(r'"\$+blob"')
 
-class FileHandler:
-    _VACUUM_ON_CHANGE = 2000
 
-    def __init__(self, parent, filepath):
+# Applies a journal record to the object at its path. The methods of the classes
+# are called, a subclass of the state may define methods with the same name.
+_REPLAY = {
+    "set": operator.setitem,
+    "delete": operator.delitem,
+    "insert": YamlList.insert,
+    "incr": YamlDict.incr,
+    "append": YamlList.append,
+    "extend": YamlList.extend,
+    "update": YamlDict.update,
+    "clear": lambda leaf: (
+        YamlDict.clear(leaf) if isinstance(leaf, YamlDict) else YamlList.clear(leaf)
+    ),
+    "set_slice": lambda leaf, bounds, values: YamlList.__setitem__(
+        leaf, slice(*bounds), values
+    ),
+    "delete_slice": lambda leaf, bounds: YamlList.__delitem__(leaf, slice(*bounds)),
+}
+
+
+class _Waiter(NamedTuple):
+    # Queued for the writer thread after the records it has to wait for
+    future: Future
+    durable: bool
+    vacuum: bool
+
+
+class FileHandler:  # pylint: disable=too-many-instance-attributes
+    # Estimated time of replaying a journal record, until it is measured on load
+    _DEFAULT_REPLAY_SECONDS = 10e-6
+    # Larger files are memory mapped on load instead of being read into memory
+    _MMAP_THRESHOLD = 1024 * 1024
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-statements
+        self,
+        parent,
+        filepath,
+        *,
+        durability="flush",
+        write_behind=None,
+        use_libyaml=True,
+        background_vacuum=False,
+        vacuum_policy=VacuumPolicy(),
+        writer_thread=False,
+        multiprocess=False,
+        follow=None,
+        journal_format="text",
+        stats_hook=None,
+        checkpoint=False,
+        blob_store=None,
+    ):
+        _check_options(
+            durability,
+            write_behind,
+            vacuum_policy,
+            writer_thread,
+            follow,
+            journal_format,
+            stats_hook,
+        )
+        if not isinstance(checkpoint, bool):
+            raise ValueError(f"Unknown checkpoint option: {checkpoint!r}")
+        if blob_store is not None and not isinstance(blob_store, BlobStore):
+            raise ValueError(f"Unknown blob store option: {blob_store!r}")
+        _check_modes(
+            write_behind, background_vacuum, writer_thread, multiprocess, follow
+        )
         self.__parent = parent
         self.__filepath = pathlib.Path(filepath)
-        self.__filepath.touch()
+        self.__follow = follow
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Open file {self.__filepath}")
-        self.__file = self.__filepath.open("r+", encoding="utf-8")
+        if follow is None:
+            self.__filepath.touch()
+            self.__file = self.__filepath.open("r+b")
+        else:
+            self.__file = self.__filepath.open("rb")
         self.__change_count = 0
-        self.__loading = True
-        self.lock = RLock()
+        self.__journal_size = 0
+        self.__snapshot_size = 0
+        self.__replay_seconds = self._DEFAULT_REPLAY_SECONDS
+        self.__vacuum_policy = vacuum_policy
+        self.__binary = journal_format == "binary"
+        self.__checkpoint_path = (
+            self.__filepath.with_name(self.__filepath.name + CHECKPOINT_SUFFIX)
+            if checkpoint
+            else None
+        )
+        self.__blob_store = blob_store
+        self.__blob_directory = self.__filepath.with_name(
+            self.__filepath.name + BLOBS_SUFFIX
+        )
+        # Whether the journal in the file has switched to binary records
+        self.__binary_journal = False
+        self.loading = True
+        self.__multiprocess = multiprocess
+        self.__process_lock_depth = 0
+        # The file content up to this offset is applied in memory
+        self.__file_end = 0
+        self.__generation = 0
+        # The end of the content applied in memory, to notice when it was replaced
+        self.__fingerprint = b""
+        self.__version = 0  # Incremented by every refresh that changed the state
+        self.__transaction_depth = 0
+        self.__transaction_records: list[str] = []
+        self.__durability = durability
+        self.__unsynced_records = 0
+        self.__write_behind = write_behind
+        self.__yaml_loader = yaml_loader(use_libyaml)
+        self.__yaml_dumper = yaml_dumper(use_libyaml)
+        # Written records by sequence number, and the sequence number of the last
+        # coalescable "set" record by (path, key)
+        self.__pending_records: dict[int, tuple[str, int]] = {}
+        self.__pending_sets: dict[tuple, int] = {}
+        self.__pending_sequence = 0
+        self.__background_vacuum = background_vacuum
+        self.__vacuum_thread = None
+        self.__vacuum_generation = 0
+        self.__stats = Stats(stats_hook)
+        # Incremented by every snapshot, the live snapshots keep the old caches of
+        # the nodes changed after them
+        self.snapshot_epoch = 0
+        self.snapshots: weakref.WeakSet = weakref.WeakSet()
+        if writer_thread is True:
+            writer_thread = WriterThread()
+        self.__writer_thread = writer_thread
+        # The last change of each thread to wait for, when it releases the lock
+        self.__pending_change = threading.local()
+        self.lock = TimedLock(
+            self.__stats,
+            (
+                functools.partial(_wait_for_change, self.__pending_change)
+                if writer_thread and writer_thread.wait
+                else None
+            ),
+        )
+        # Taken after the lock, when the file is written by the writer thread
+        self.__file_lock = RLock()
+        # Records (vacuum_generation, record, num_of_changes) and waiters for the
+        # writer thread, the record is the change text or the arguments to encode
+        self.__queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.__change_condition = threading.Condition(self.lock)
+        self.__stopping = threading.Event()
+        self.__threads: list[threading.Thread] = []
+        if follow is not None:
+            self.__start_periodic("follow", follow.milliseconds, FileHandler.refresh)
+        if writer_thread:
+            self.__start_writer()
+        if isinstance(durability, FsyncInterval):
+            self.__start_periodic(
+                "fsync", durability.milliseconds, FileHandler.__sync_task
+            )
+        if write_behind is not None:
+            self.__start_periodic(
+                "write-behind", write_behind.milliseconds, FileHandler.__drain
+            )
 
-    def vacuum(self, do_logging=True):
+    def __start_periodic(self, name, milliseconds, task):
+        thread = threading.Thread(
+            target=self.__run_periodically,
+            args=(weakref.ref(self), milliseconds / 1000, self.__stopping, task),
+            name=f"persistedstate-{name}-{self.__filepath.name}",
+            daemon=True,
+        )
+        thread.start()
+        self.__threads.append(thread)
+
+    @staticmethod
+    def __run_periodically(handler_ref, interval, stop_event, task):
+        # Keep only a weak reference, so the state can be garbage collected
+        while not stop_event.wait(interval):
+            handler = handler_ref()
+            if handler is None:
+                return
+            with handler.lock:
+                if not handler.__file.closed:
+                    task(handler)
+            del handler
+
+    def __start_writer(self):
+        thread = threading.Thread(
+            target=self.__run_writer,
+            args=(weakref.ref(self), self.__queue),
+            name=f"persistedstate-writer-{self.__filepath.name}",
+            daemon=True,
+        )
+        thread.start()
+        self.__threads.append(thread)
+
+    @staticmethod
+    def __run_writer(handler_ref, records):
+        # Keep only a weak reference, so the state can be garbage collected. The
+        # queue is not locked, everything queued meanwhile is written at once.
+        while True:
+            batch = [records.get()]
+            with contextlib.suppress(queue.Empty):
+                while batch[-1] is not None:
+                    batch.append(records.get_nowait())
+            stopping = batch[-1] is None
+            if stopping:
+                batch.pop()
+            handler = handler_ref()
+            if handler is None:
+                return
+            if batch:
+                FileHandler.__write_queue(handler, batch)
+            del handler
+            if stopping:
+                return
+
+    def __write_queue(self, batch):
+        waiters = [item for item in batch if isinstance(item, _Waiter)]
+        try:
+            with self.__file_lock:
+                # Records queued before a vacuum are contained in its snapshot
+                records = [
+                    (self.__encode_queued(record), num_of_changes)
+                    for generation, record, num_of_changes in (
+                        item for item in batch if not isinstance(item, _Waiter)
+                    )
+                    if generation == self.__vacuum_generation
+                ]
+                if records:
+                    self.__write_records(records)
+                if self.__unsynced_records and any(w.durable for w in waiters):
+                    self.__fsync()
+            # The vacuum may wait for a thread holding the lock, so only the
+            # waiters asking for it wait for it
+            for waiter in waiters:
+                if not waiter.vacuum:
+                    waiter.future.set_result(None)
+            if any(waiter.vacuum for waiter in waiters) or self.__needs_vacuum():
+                self.__vacuum_in_writer()
+        except Exception as exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Writing the journal failed")
+            for waiter in waiters:
+                if not waiter.future.done():
+                    waiter.future.set_exception(exception)
+            return
+        for waiter in waiters:
+            if waiter.vacuum:
+                waiter.future.set_result(None)
+
+    def __encode_queued(self, record):
+        if isinstance(record, (str, bytes)):
+            return record
+        return self.__encode_record(record)
+
+    def __vacuum_in_writer(self):
         with self.lock:
+            if self.__file.closed:
+                return
+            snapshot = take_snapshot(self, self.__parent)
+            # The snapshot contains the queued and buffered records
+            self.__pending_records.clear()
+            self.__pending_sets.clear()
+            self.__vacuum_generation += 1
+            generation = self.__vacuum_generation
+        temp_path = self.__filepath.with_name(self.__filepath.name + ".vacuum")
+        try:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Vacuuming in writer thread")
+            start = time.perf_counter()
+            snapshot = copy_snapshot(snapshot)  # outside of the lock
+            snapshot_size = self.__dump_snapshot(snapshot, temp_path)
+            with self.__file_lock:
+                if generation != self.__vacuum_generation or self.__file.closed:
+                    return
+                self.__replace_file(temp_path, snapshot_size)
+                self.__write_checkpoint(snapshot)
+                self.__change_count = 0
+                self.__journal_size = 0
+                self.__stats.vacuum_bytes += snapshot_size
+                self.__stats.measure("vacuum", time.perf_counter() - start)
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    def __dump_snapshot(self, snapshot, temp_path):
+        with temp_path.open("wb") as temp_file:
+            dump_yaml(snapshot, temp_file, self.__yaml_dumper)
+            snapshot_size = temp_file.tell() - 1
+            temp_file.truncate(snapshot_size)  # without the last line break
+        return snapshot_size
+
+    def __replace_file(self, temp_path, snapshot_size):
+        self.__file.close()
+        os.replace(temp_path, self.__filepath)
+        self.__file = self.__filepath.open("r+b")
+        self.__file.seek(0, os.SEEK_END)
+        self.__snapshot_size = snapshot_size
+        # The records appended by the background vacuum start with the marker
+        self.__binary_journal = self.__binary and self.__file.tell() > snapshot_size
+        if self.__durability != "flush":
+            self.__unsynced_records = 0
+            _fsync_directory(self.__filepath.parent)
+
+    def vacuum(self, do_logging=True):
+        if self.__follow is not None:
+            raise TypeError("The state is read-only")
+        with self.lock, self.__file_lock, self.__process_lock():
             if logger.isEnabledFor(logging.DEBUG) and do_logging:
                 logger.debug("Vacuuming")
-            yaml_str = yaml.safe_dump(
-                convert_to_json_like(self.__parent), allow_unicode=True, sort_keys=True
-            )
-            self.__file.write(yaml_str)  # just padding
-            self.__file.write("\n---\n### LAST VALID STATE ###\n")
-            self.__file.write(yaml_str)
-            self.__file.seek(0)
-            self.__file.write(yaml_str)
-            self.__file.write("...\n")
+            start = time.perf_counter()
+            # The snapshot contains every in-memory change, including the ones
+            # buffered by an open transaction, by write behind or for the writer
+            # thread
+            self.__transaction_records.clear()
+            self.__pending_records.clear()
+            self.__pending_sets.clear()
+            self.__change_count = 0
+            self.__journal_size = 0
+            self.__vacuum_generation += 1  # Discard the running background vacuum
+            # Write a safety copy of the state to the end of the file first, then
+            # copy it to the beginning. The state is rendered directly from the
+            # live objects into the file only once.
+            copy_start = self.__file.seek(0, os.SEEK_END)
+            self.__file.write(INCOMPLETE_STATE)
+            if self.__multiprocess:
+                self.__generation += 1
+                self.__file.write(GENERATION_MARKER + b"%d\n" % self.__generation)
+            dump_yaml(self.__parent, self.__file, self.__yaml_dumper)
+            yaml_size = self.__file.tell() - copy_start - len(INCOMPLETE_STATE)
+            self.__validate_safety_copy(copy_start)
+            if yaml_size + len(b"...\n") > copy_start:
+                # The beginning would overwrite the safety copy, make another one
+                new_copy_start = copy_start + len(INCOMPLETE_STATE) + yaml_size
+                self.__file.write(INCOMPLETE_STATE)
+                self.__copy(
+                    copy_start + len(INCOMPLETE_STATE),
+                    new_copy_start + len(INCOMPLETE_STATE),
+                    yaml_size,
+                )
+                self.__validate_safety_copy(new_copy_start)
+                copy_start = new_copy_start
+            self.__copy(copy_start + len(INCOMPLETE_STATE), 0, yaml_size)
+            self.__file.write(b"...\n")
             self.__file.flush()
-            self.__file.seek(self.__file.tell() - 5)
-            self.__file.truncate()
+            self.__file.truncate(yaml_size - 1)  # without the last line break
+            self.__file.seek(yaml_size - 1)
+            self.__snapshot_size = self.__file_end = yaml_size - 1
+            self.__binary_journal = False
+            if self.__durability != "flush":
+                self.__fsync()
+                _fsync_directory(self.__filepath.parent)
+            if self.__checkpoint_path is not None:
+                self.__write_checkpoint(unwrap(self.__parent))
+            self.__remove_unreferenced_blobs()
+            self.__stats.vacuum_bytes += yaml_size
+            self.__stats.measure("vacuum", time.perf_counter() - start)
+
+    def __remove_unreferenced_blobs(self):
+        # Only the in-place vacuum removes blobs: the file contains exactly the
+        # in-memory state then, and no blob is being written. Other processes may
+        # still read the blobs of the values they have not caught up on, and
+        # followers get the grace period to do so.
+        if self.__multiprocess or not self.__blob_directory.is_dir():
+            return
+        # The snapshots still used may reference blobs removed from the state
+        referenced = blob_references([self.__parent, *copy_live_snapshots(self)])
+        blob_store = self.__blob_store or BlobStore()
+        removed = remove_unreferenced_blobs(
+            self.__blob_directory, referenced, blob_store.grace_seconds
+        )
+        if removed and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Removed {removed} unreferenced blobs")
 
-    def record_change(self, *args):
-        if self.__loading:
+    def __write_checkpoint(self, snapshot):
+        # Called when the snapshot was written, the journal may follow it already
+        if self.__checkpoint_path is None:
             return
+        temp_path = self.__checkpoint_path.with_name(
+            self.__checkpoint_path.name + ".tmp"
+        )
+        try:
+            end = self.__file.tell()
+            self.__file.seek(0)
+            digest = hashlib.blake2b(digest_size=16)
+            size = self.__snapshot_size
+            while size > 0:
+                chunk = self.__file.read(min(size, _COPY_CHUNK_SIZE))
+                digest.update(chunk)
+                size -= len(chunk)
+            self.__file.seek(end)
+            header = _CHECKPOINT_HEADER.pack(
+                _CHECKPOINT_VERSION, self.__snapshot_size, digest.digest()
+            )
+            with temp_path.open("wb") as file:
+                file.write(header)
+                marshal.dump(snapshot, file)
+            os.replace(temp_path, self.__checkpoint_path)
+        except (OSError, ValueError):  # ValueError: not marshalable
+            logger.exception("Writing the checkpoint failed")
+            temp_path.unlink(missing_ok=True)
+            self.__checkpoint_path.unlink(missing_ok=True)
+
+    def __read_checkpoint(self, data):
+        # The snapshot and its end, if the checkpoint was written for the snapshot in
+        # the file (which was not vacuumed or edited since)
+        try:
+            with self.__checkpoint_path.open("rb") as file:
+                version, snapshot_size, snapshot_digest = _CHECKPOINT_HEADER.unpack(
+                    file.read(_CHECKPOINT_HEADER.size)
+                )
+                if (
+                    version != _CHECKPOINT_VERSION
+                    or data[snapshot_size : snapshot_size + len(SEPARATOR)]
+                    not in (b"", SEPARATOR)
+                    or data.find(LAST_VALID_STATE, snapshot_size) >= 0
+                    or data.find(INCOMPLETE_STATE, snapshot_size) >= 0
+                ):
+                    return None
+                with memoryview(data) as view:
+                    digest = hashlib.blake2b(view[:snapshot_size], digest_size=16)
+                if digest.digest() != snapshot_digest:
+                    return None
+                snapshot = marshal.loads(file.read())
+        except (OSError, struct.error, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(snapshot, dict):
+            return None
+        return snapshot_size, snapshot
+
+    def __validate_safety_copy(self, copy_start):
+        self.__file.flush()
+        if self.__durability != "flush":
+            os.fsync(self.__file.fileno())
+        end = self.__file.tell()
+        self.__file.seek(copy_start)
+        self.__file.write(LAST_VALID_STATE)
+        self.__file.flush()
+        if self.__durability != "flush":
+            os.fsync(self.__file.fileno())
+        self.__file.seek(end)
+
+    def __copy(self, source, destination, size):
+        while size > 0:
+            self.__file.seek(source)
+            chunk = self.__file.read(min(size, _COPY_CHUNK_SIZE))
+            self.__file.seek(destination)
+            self.__file.write(chunk)
+            source += len(chunk)
+            destination += len(chunk)
+            size -= len(chunk)
+
+    def record_change(self, operation, node, *args):
+        # Returns the copy of the last argument (the new value) to store in memory
+        if self.loading:
+            return args[-1] if args else None  # not referenced elsewhere
+        if self.__follow is not None:
+            raise TypeError("The state is read-only")
         with self.lock:
-            if self.__change_count >= self._VACUUM_ON_CHANGE:
+            path = node_path(node)
+            if path is None and not removed_elsewhere(node):
+                # The value was removed from the state by this process
+                if not args:
+                    return None
+                value = _escape_change(operation, args[-1])
+                return json.loads(encode_value(value, False))
+            with self.__process_lock():
+                if self.__multiprocess:
+                    # The records of the other processes may have moved it
+                    path = node_path(node)
+                if path is None:
+                    raise LookupError(
+                        f"The changed {type(node).__name__} was removed by"
+                        " another process"
+                    )
+                return self.__record_change(operation, path, args)
+
+    def __record_change(self, operation, path, args):
+        if self.__blob_store is not None and args:
+            args = self.__store_blobs(operation, args)
+        args = (operation, path, *args)
+        if self.__transaction_depth:
+            change_text, value = self.__encode_change(args)
+            self.__transaction_records.append(change_text)
+        elif self.__write_behind is not None:
+            if len(self.__pending_records) >= self.__write_behind.operations:
+                self.__drain()
+            change_text, value = self.__encode_change(args)
+            self.__add_pending(change_text, 1, args)
+        elif self.__writer_thread:
+            value = self.__queue_change(args)
+        else:
+            change_text, value = self.__encode_change(args)
+            # The change is not applied in memory yet
+            if self.__needs_vacuum():
+                if self.__background_vacuum:
+                    self.__start_background_vacuum()
+                else:
+                    self.vacuum()
+            self.__write_records([(change_text, 1)])
+        return value
+
+    def __store_blobs(self, operation, args):
+        # Long strings assigned as values (not the ones nested in an assigned
+        # dict or list) are replaced by a reference to their blob
+        value = args[-1]
+        if operation in ("set", "insert", "append"):
+            value = self.__store_blob(value)
+        elif operation in ("extend", "set_slice"):
+            value = [self.__store_blob(item) for item in value]
+        elif operation == "update":
+            value = {key: self.__store_blob(item) for key, item in value.items()}
+        else:
+            return args
+        return (*args[:-1], value)
+
+    def __store_blob(self, value):
+        if not isinstance(value, str) or len(value) < self.__blob_store.min_length:
+            return value
+        durable = self.__durability != "flush"
+        reference, new = store_blob(self.__blob_directory, value, durable)
+        if new and durable:
+            _fsync_directory(self.__blob_directory)
+            _fsync_directory(self.__filepath.parent)
+        self.__stats.blobs_written += new
+        return reference
+
+    def load_blob(self, value):
+        # The content of a blob reference in the state, None for other values.
+        # Also without the option, which only decides what is stored as a blob.
+        digest = blob_digest(value)
+        if digest is None:
+            return None
+        return read_blob(self.__blob_directory, digest)
+
+    def __queue_change(self, args):
+        if all(isinstance(arg, _SCALARS) for arg in args[2:]):
+            # Serialized by the writer thread, outside of the lock
+            self.__enqueue([(args, 1)])
+            return args[-1]
+        change_text, value = self.__encode_change(args)
+        self.__enqueue([(change_text, 1)])
+        return value
+
+    def __encode_change(self, args):
+        # A dict or list is serialized only once, and its copy is parsed from the
+        # JSON, which is much faster than walking it again
+        value = args[-1]
+        if len(args) < 3 or isinstance(value, _SCALARS):
+            return self.__encode_record(args), value
+        value_text = encode_value(value, self.__binary)
+        if _ESCAPED_KEY_TEXT.search(value_text):
+            value_text = encode_value(_escape_change(args[0], value), self.__binary)
+        if self.__binary:
+            return encode_binary_record(args, value_text), json.loads(value_text)
+        return encode_text_record(args, value_text), json.loads(value_text)
+
+    def __encode_record(self, args):
+        if self.__binary:
+            return encode_binary_record(args)
+        return encode_text_record(args)
+
+    def __needs_vacuum(self):
+        if self.__vacuum_thread is not None:
+            return False
+        policy = self.__vacuum_policy
+        max_journal_size = max(
+            policy.min_journal_bytes, policy.journal_ratio * self.__snapshot_size
+        )
+        replay_time = self.__change_count * self.__replay_seconds
+        return (
+            self.__journal_size >= max_journal_size
+            or replay_time * 1000 >= policy.replay_budget_milliseconds
+        )
+
+    def __enqueue(self, records):
+        generation = self.__vacuum_generation
+        for record, num_of_changes in records:
+            self.__queue.put((generation, record, num_of_changes))
+        if self.__writer_thread.wait:
+            future: Future = Future()
+            self.__queue.put(_Waiter(future, self.__durability != "flush", False))
+            self.__pending_change.future = future
+
+    def __write_applied_records(self, records):
+        if self.__writer_thread:
+            self.__enqueue(records)
+            return
+        if self.__needs_vacuum() and not self.__background_vacuum:
+            # The changes are already applied in memory, so the snapshot
+            # contains them, there is no need to write them
+            self.vacuum()
+            return
+        self.__write_records(records)
+        if self.__background_vacuum and self.__needs_vacuum():
+            self.__start_background_vacuum()
+
+    def __start_background_vacuum(self):
+        # The in-memory state must be the same as the file content here
+        self.__file.flush()
+        journal_start = self.__file.tell()
+        snapshot = take_snapshot(self, self.__parent)
+        self.__change_count = 0
+        self.__journal_size = 0
+        self.__vacuum_generation += 1
+        self.__vacuum_thread = threading.Thread(
+            target=self.__vacuum_in_background,
+            # In a list, so the thread releases it after copying it
+            args=([snapshot], journal_start, self.__vacuum_generation),
+            name=f"persistedstate-vacuum-{self.__filepath.name}",
+            daemon=True,
+        )
+        self.__vacuum_thread.start()
+
+    def __vacuum_in_background(self, snapshots, journal_start, generation):
+        temp_path = self.__filepath.with_name(self.__filepath.name + ".vacuum")
+        try:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Vacuuming in background")
+            start = time.perf_counter()
+            snapshot = copy_snapshot(snapshots.pop())
+            snapshot_size = self.__dump_snapshot(snapshot, temp_path)
+            with self.lock:
+                if generation != self.__vacuum_generation or self.__file.closed:
+                    return
+                # Append the records which were written in the meantime
+                self.__file.flush()
+                journal_end = self.__file.tell()
+                self.__file.seek(journal_start)
+                journal = self.__file.read(journal_end - journal_start)
+                if self.__binary and journal and not journal.startswith(BINARY_JOURNAL):
+                    journal = BINARY_JOURNAL + journal
+                with temp_path.open("ab") as temp_file:
+                    temp_file.write(journal)
+                    temp_file.flush()
+                    if self.__durability != "flush":
+                        os.fsync(temp_file.fileno())
+                self.__replace_file(temp_path, snapshot_size)
+                self.__write_checkpoint(snapshot)
+                self.__stats.vacuum_bytes += snapshot_size
+                self.__stats.measure("vacuum", time.perf_counter() - start)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Background vacuum failed")
+        finally:
+            temp_path.unlink(missing_ok=True)
+            self.__vacuum_thread = None
+
+    def __add_pending(self, change_text, num_of_changes, args):
+        self.__pending_sequence += 1
+        sequence = self.__pending_sequence
+        self.__pending_records[sequence] = (change_text, num_of_changes)
+        if args[0] != "set":
+            # Any other change may move or remove values, don't coalesce over it
+            self.__pending_sets.clear()
+            return
+        path, key = args[1], args[2]
+        # Changing a nested value depends on the previous "set" of its parents
+        for depth, selector in enumerate(path):
+            self.__pending_sets.pop((tuple(path[:depth]), selector), None)
+        previous = self.__pending_sets.get((tuple(path), key))
+        if previous is not None:
+            del self.__pending_records[previous]
+        self.__pending_sets[(tuple(path), key)] = sequence
+
+    def __drain(self):
+        if not self.__pending_records:
+            return
+        records = list(self.__pending_records.values())
+        self.__pending_records.clear()
+        self.__pending_sets.clear()
+        self.__write_applied_records(records)
+
+    def flush(self):
+        self.barrier(durable=self.__durability != "flush").result()
+
+    def barrier(self, *, durable=False, vacuum=False):
+        # The future is done when the changes made so far are written, synced
+        # to the disk if durable, and vacuumed if requested
+        future = Future()
+        with self.lock:
+            self.__drain()
+            if self.__writer_thread and not self.__stopping.is_set():
+                self.__queue.put(_Waiter(future, durable, vacuum))
+                return future
+            if vacuum:
                 self.vacuum()
-                self.__change_count = 0
-            change_text = json.dumps([*args], cls=CustomJsonEncoder, ensure_ascii=False)
-            self.__file.write("\n---\n" + change_text)
-            self.__file.flush()
-            self.__change_count += 1
+            elif durable and self.__unsynced_records:
+                self.__fsync()
+        future.set_result(None)
+        return future
+
+    @contextlib.contextmanager
+    def changing(self):
+        # Held while a change is checked and recorded. The records of the other
+        # processes are applied first, so the checks see their changes.
+        with self.lock, self.__process_lock():
+            yield
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock, self.__process_lock():
+            self.__transaction_depth += 1
+            try:
+                yield
+            finally:
+                self.__transaction_depth -= 1
+                if self.__transaction_depth == 0:
+                    self.__commit_transaction()
+
+    def __commit_transaction(self):
+        records = self.__transaction_records
+        self.__transaction_records = []
+        if not records:
+            return
+        if len(records) == 1:
+            record = (records[0], 1)
+        elif self.__binary:
+            record = (encode_binary_batch(records), len(records))
+        else:
+            record = ('["batch", [' + ", ".join(records) + "]]", len(records))
+        if self.__write_behind is not None:
+            self.__add_pending(*record, ("batch",))
+        else:
+            self.__write_applied_records([record])
+
+    def __write_records(self, records):
+        if self.__binary:
+            data = b"".join(frame_binary_record(payload) for payload, _ in records)
+            if not self.__binary_journal:
+                data = BINARY_JOURNAL + data
+                self.__binary_journal = True
+        else:
+            data = b"".join(
+                SEPARATOR + change_text.encode("utf-8") for change_text, _ in records
+            )
+        start = time.perf_counter()
+        self.__file.write(data)
+        self.__file.flush()
+        self.__stats.measure("flush", time.perf_counter() - start)
+        self.__file_end = self.__file.tell()
+        self.__journal_size += len(data)
+        self.__stats.records_written += len(records)
+        self.__stats.bytes_written += len(data)
+        for change_text, num_of_changes in records:
+            self.__change_count += num_of_changes
+            self.__stats.changes_written += num_of_changes
             if logger.isEnabledFor(SPAM_LOG):
                 logger.log(SPAM_LOG, f"Change ({self.__change_count}): {change_text}")
+        self.__unsynced_records += len(records)
+        if self.__durability == "fsync" or (
+            isinstance(self.__durability, FsyncEvery)
+            and self.__unsynced_records >= self.__durability.records
+        ):
+            self.__fsync()
 
-    @staticmethod
-    def dict_representer(dumper: yaml.SafeDumper, obj: YamlDict):
-        return dumper.represent_mapping("tag:yaml.org,2002:map", obj._YamlDict__cache)
+    def __fsync(self):
+        with self.__file_lock:
+            start = time.perf_counter()
+            os.fsync(self.__file.fileno())
+            self.__stats.measure("fsync", time.perf_counter() - start)
+            self.__unsynced_records = 0
 
-    @staticmethod
-    def list_representer(dumper: yaml.SafeDumper, obj: YamlList):
-        return dumper.represent_sequence("tag:yaml.org,2002:seq", obj._YamlList__cache)
+    def __sync_task(self):
+        if self.__unsynced_records:
+            self.__fsync()
+
+    @contextlib.contextmanager
+    def __process_lock(self, catch_up=True):
+        # Other processes cannot write the file meanwhile, and the records they
+        # have written since are applied first
+        if not self.__multiprocess and (self.__follow is None or fcntl is None):
+            yield
+            return
+        if self.__process_lock_depth == 0:
+            # Followers only wait for the writing processes
+            operation = fcntl.LOCK_EX if self.__follow is None else fcntl.LOCK_SH
+            fcntl.flock(self.__file.fileno(), operation)
+        self.__process_lock_depth += 1
+        try:
+            if catch_up and self.__process_lock_depth == 1:
+                self.__catch_up()
+                self.__check_journal_format()
+            yield
+        finally:
+            self.__process_lock_depth -= 1
+            if self.__process_lock_depth == 0:
+                fcntl.flock(self.__file.fileno(), fcntl.LOCK_UN)
+
+    def refresh(self):
+        with self.lock:
+            if self.__follow is None and not self.__multiprocess:
+                return False
+            with self.__process_lock(catch_up=False):
+                changed = self.__catch_up()
+            if changed:
+                self.__version += 1
+                self.__change_condition.notify_all()
+                if self.__follow is not None and self.__follow.on_change is not None:
+                    self.__follow.on_change(self.__parent)
+            return changed
+
+    def wait_for_change(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = self.__follow.milliseconds / 1000 if self.__follow else 0.1
+        with self.lock:
+            version = self.__version
+            while not self.refresh() and self.__version == version:
+                if deadline is None:
+                    self.__change_condition.wait(interval)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.__change_condition.wait(min(interval, remaining))
+            return True
+
+    def __catch_up(self):
+        if self.__follow is not None and self.__is_replaced():
+            self.__load()
+            return True
+        self.__file.seek(0)
+        generation = read_generation(self.__file.readline(64))
+        file_end = self.__file.seek(0, os.SEEK_END)
+        if generation != self.__generation or file_end < self.__file_end:
+            # Vacuumed by another process
+            self.__load()
+            return True
+        if file_end == self.__file_end:
+            return False
+        self.__file.seek(self.__file_end)
+        data = self.__file.read()
+        if LAST_VALID_STATE in data or INCOMPLETE_STATE in data:
+            # The vacuum of another process was interrupted
+            self.__load()
+            return True
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Catching up {len(data)} bytes")
+        self.loading = True
+        valid_end = 0
+        for valid_end, update in self.__parse_appended(data):
+            if update is None:
+                continue
+            if isinstance(update, dict):
+                self.__load()
+                return True
+            self.__apply(update)
+            self.__change_count += 1
+        self.loading = False
+        if not self.__binary_journal and data.find(BINARY_JOURNAL, 0, valid_end) >= 0:
+            self.__binary_journal = True
+        self.__journal_size += valid_end
+        self.__file_end += valid_end
+        if valid_end < len(data) and self.__follow is None:
+            # Another process was killed during writing
+            self.__file.truncate(self.__file_end)
+        self.__file.seek(self.__file_end)
+        self.__fingerprint = self.__read_fingerprint()
+        return valid_end > 0
+
+    def __parse_appended(self, data):
+        if self.__binary_journal:
+            return parse_binary_records(data)
+        if self.__follow is not None:
+            data = data[: complete_records_end(data)]
+        return parse_documents(data, self.__yaml_loader)
+
+    def __is_replaced(self):
+        # Vacuumed by a writer, which does not mark the generation
+        try:
+            if os.stat(self.__filepath).st_ino != os.fstat(self.__file.fileno()).st_ino:
+                self.__file.close()
+                self.__file = self.__filepath.open("rb")
+                return True
+        except FileNotFoundError:
+            return False
+        return self.__read_fingerprint() != self.__fingerprint
+
+    def __read_fingerprint(self):
+        if self.__follow is None:
+            return b""
+        self.__file.seek(max(self.__file_end - 64, 0))
+        return self.__file.read(min(self.__file_end, 64))
 
     def load(self):
-        self.__loading = True
+        with self.lock, self.__process_lock(catch_up=False):
+            self.__load()
+            self.__check_journal_format()
+
+    def __check_journal_format(self):
+        # Text records cannot follow binary ones, vacuuming starts a new journal
+        if self.__binary_journal and not self.__binary and self.__follow is None:
+            self.vacuum()
+
+    def __load(self):
+        self.loading = True
+        load_start = time.perf_counter()
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(
                 f"File size on load: {self.__filepath.stat().st_size // 1024} kb"
             )
-        for update in yaml.safe_load_all(self.__file):
-            if logger.isEnabledFor(SPAM_LOG):
-                logger.log(SPAM_LOG, f"Update step: {update}")
-            if update is None:
-                continue
-            if isinstance(update, dict):
-                self.__parent.clear()
-                for key, value in update.items():
-                    self.__parent[key] = value
-            elif update[0] == "set":
-                path, key, value = update[1:]
-                self.__leaf_object(path)[key] = value
-            elif update[0] == "delete":
-                path, key = update[1:]
-                del self.__leaf_object(path)[key]
-            elif update[0] == "insert":
-                path, index, value = update[1:]
-                self.__leaf_object(path).insert(index, value)
+        with self.__map_file() as data:
+            children = clear_for_reload(self.__parent)
+            valid_end = snapshot_end = 0
+            replay_start = time.perf_counter()
+            checkpoint = None
+            if self.__checkpoint_path is not None and data:
+                checkpoint = self.__read_checkpoint(data)
+            if checkpoint is None:
+                documents = parse_documents(data, self.__yaml_loader)
             else:
-                raise RuntimeError(f"Unknown update step during recovery: {update}")
-        self.__loading = False
+                documents = itertools.chain(
+                    [checkpoint],
+                    parse_documents(data, self.__yaml_loader, checkpoint[0]),
+                )
+            for valid_end, update in documents:
+                if logger.isEnabledFor(SPAM_LOG):
+                    logger.log(SPAM_LOG, f"Update step: {update}")
+                if update is None:
+                    continue
+                if isinstance(update, dict):
+                    self.__parent.clear()
+                    self.__parent.update(unescape(update))
+                    refill_after_reload(self.__parent, children)
+                    snapshot_end = valid_end
+                    self.__change_count = 0
+                    replay_start = time.perf_counter()
+                else:
+                    self.__apply(update)
+                    self.__change_count += 1
+            data_size = len(data)
+            self.__binary_journal = (
+                data.find(BINARY_JOURNAL, snapshot_end, valid_end) >= 0
+            )
+            self.__generation = read_generation(data)
+        replay_seconds = time.perf_counter() - replay_start
+        if self.__change_count >= 100:
+            self.__replay_seconds = replay_seconds / self.__change_count
+        self.__stats.replayed_records += self.__change_count
+        self.__stats.measure("replay", replay_seconds)
+        self.__snapshot_size = snapshot_end
+        self.__journal_size = valid_end - snapshot_end
+        if valid_end < data_size and self.__follow is None:
+            # The last record was not written completely (e.g. the process was
+            # killed during writing), so it has not been committed
+            self.__file.truncate(valid_end)
+        self.__file.seek(valid_end)
+        self.__file_end = valid_end
+        self.__fingerprint = self.__read_fingerprint()
+        self.loading = False
+        self.__stats.measure("load", time.perf_counter() - load_start)
+
+    def snapshot(self):
+        with self.lock:
+            return take_snapshot(self, self.__parent)
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.__stats.as_dict(),
+                "snapshot_bytes": self.__snapshot_size,
+                "journal_bytes": self.__journal_size,
+                "journal_changes": self.__change_count,
+            }
+
+    def __map_file(self):
+        # The documents are parsed directly from the memory mapped file, without
+        # copying the file content into memory
+        size = os.fstat(self.__file.fileno()).st_size
+        if size < self._MMAP_THRESHOLD or self.__follow is not None:
+            # The writer may truncate the file under a follower, which would crash
+            # while accessing the memory map
+            self.__file.seek(0)
+            return contextlib.nullcontext(self.__file.read())
+        return mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __apply(self, update):
+        if update[0] == "batch":
+            for step in update[1]:
+                self.__apply(step)
+            return
+        replay = _REPLAY.get(update[0])
+        if replay is None:
+            raise RuntimeError(f"Unknown update step during recovery: {update}")
+        replay(self.__leaf_object(update[1]), *update[2:])
 
     def __leaf_object(self, path):
         obj = self.__parent
@@ -105,12 +1080,101 @@ class FileHandler:
         return obj
 
     def close(self, do_logging=True):
+        with self.lock:
+            self.__stopping.set()
+            if self.__writer_thread:
+                self.__queue.put(None)  # after the waiters of the barriers
+        for thread in self.__threads:
+            if thread is not threading.current_thread():
+                thread.join()
         if self.__file.closed:
             return
-        self.vacuum(do_logging)
+        if self.__follow is None:
+            self.vacuum(do_logging)
         if logger.isEnabledFor(logging.DEBUG) and do_logging:
             logger.debug("Close file")
         self.__file.close()
+        vacuum_thread = self.__vacuum_thread
+        if (
+            vacuum_thread is not None
+            and vacuum_thread is not threading.current_thread()
+        ):
+            vacuum_thread.join()
 
     def __del__(self):
-        self.close(do_logging=False)
+        if hasattr(self, "_FileHandler__file"):  # The constructor may have failed
+            self.close(do_logging=False)
+
+
+def _check_options(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    durability,
+    write_behind,
+    vacuum_policy,
+    writer_thread,
+    follow,
+    journal_format,
+    stats_hook,
+):
+    if durability not in ("flush", "fsync") and not isinstance(
+        durability, (FsyncEvery, FsyncInterval)
+    ):
+        raise ValueError(f"Unknown durability: {durability!r}")
+    if write_behind is not None and not isinstance(write_behind, WriteBehind):
+        raise ValueError(f"Unknown write behind policy: {write_behind!r}")
+    if not isinstance(vacuum_policy, VacuumPolicy):
+        raise ValueError(f"Unknown vacuum policy: {vacuum_policy!r}")
+    if not isinstance(writer_thread, (bool, WriterThread)):
+        raise ValueError(f"Unknown writer thread option: {writer_thread!r}")
+    if write_behind is not None and isinstance(writer_thread, WriterThread):
+        if writer_thread.wait:
+            raise ValueError(
+                "Waiting for the writer cannot be combined with write behind"
+            )
+    if follow is not None and not isinstance(follow, Follow):
+        raise ValueError(f"Unknown follow option: {follow!r}")
+    if journal_format not in ("text", "binary"):
+        raise ValueError(f"Unknown journal format: {journal_format!r}")
+    if stats_hook is not None and not callable(stats_hook):
+        raise ValueError(f"The stats hook is not callable: {stats_hook!r}")
+
+
+def _check_modes(write_behind, background_vacuum, writer_thread, multiprocess, follow):
+    if multiprocess:
+        if fcntl is None:
+            raise ValueError("Multi-process mode is not supported on this platform")
+        if background_vacuum or writer_thread or write_behind is not None:
+            raise ValueError(
+                "Multi-process mode cannot be combined with background vacuum,"
+                " writer thread or write behind"
+            )
+    if follow is not None and (
+        background_vacuum or writer_thread or write_behind is not None or multiprocess
+    ):
+        raise ValueError(
+            "Following cannot be combined with background vacuum, writer"
+            " thread, write behind or multi-process mode"
+        )
+
+
+def _escape_change(operation, value):
+    # The items of an update are escaped, not the dict of the items
+    if operation == "update":
+        return {key: escape_value(item) for key, item in value.items()}
+    return escape_value(value)
+
+
+def _wait_for_change(pending_change):
+    future = getattr(pending_change, "future", None)
+    if future is not None:
+        pending_change.future = None
+        future.result()
+
+
+def _fsync_directory(path):
+    if not hasattr(os, "O_DIRECTORY"):
+        return  # Directories cannot be opened (and need not be synced) on Windows
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,435 @@
+import functools
+import json
+import logging
+import struct
+import zlib
+from collections.abc import Mapping, Sequence
+from typing import IO, Any, Callable, Iterator, Optional
+
+import yaml
+from yaml.events import (
+    AliasEvent,
+    DocumentEndEvent,
+    DocumentStartEvent,
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+    StreamEndEvent,
+)
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+from persistedstate.types import CustomJsonEncoder, YamlDict, YamlList, escape
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = b"\n---\n"
+LAST_VALID_STATE = SEPARATOR + b"### LAST VALID STATE ###\n"
+# Written in place of LAST_VALID_STATE until the safety copy is complete
+INCOMPLETE_STATE = SEPARATOR + b"### INCOMPLETE STATE ###\n"
+
+# Written at the beginning of the snapshot in multi-process mode, so the other
+# processes notice the vacuum
+GENERATION_MARKER = b"# generation: "
+
+# Followed by binary journal records until the end of the file. A record is the
+# varint length of the payload, its CRC32 (4 bytes, little endian) and the payload:
+# an opcode and the compact JSON of the arguments, without the enclosing brackets.
+BINARY_JOURNAL = SEPARATOR + b"### BINARY JOURNAL ###\n"
+
+_OPCODES = {
+    "set": b"s",
+    "delete": b"d",
+    "insert": b"i",
+    "batch": b"b",
+    "incr": b"+",
+    "append": b"a",
+    "extend": b"e",
+    "update": b"u",
+    "clear": b"c",
+    "set_slice": b"S",
+    "delete_slice": b"D",
+}
+_OPERATIONS = {opcode[0]: operation for operation, opcode in _OPCODES.items()}
+_CRC = struct.Struct("<I")
+
+_json_decoder = json.JSONDecoder()
+
+# Longer documents are read by the YAML parser in pieces, instead of copying them
+_STREAM_THRESHOLD = 1024 * 1024
+# Long enough to recognize the markers at the beginning of a document
+_PREFIX_SIZE = 32
+
+
+def read_generation(data: bytes) -> int:
+    head = data[:64]
+    if not head.startswith(GENERATION_MARKER):
+        return 0
+    line = head[len(GENERATION_MARKER) :].split(b"\n", 1)[0]
+    try:
+        return int(line)
+    except ValueError:
+        return 0
+
+
+def yaml_loader(use_libyaml: bool = True) -> type:
+    if use_libyaml and yaml.__with_libyaml__:
+        return yaml.CSafeLoader
+    return yaml.SafeLoader
+
+
+def yaml_dumper(use_libyaml: bool = True) -> type:
+    if use_libyaml and yaml.__with_libyaml__:
+        return yaml.CSafeDumper
+    return yaml.SafeDumper
+
+
+# Same output as `yaml.dump(value, stream, allow_unicode=True, sort_keys=True)`, but
+# PyYAML would build the node graph of the whole document before writing anything.
+# This emits the events while walking the state, so only the scalars are represented.
+def dump_yaml(value: Any, stream: IO[bytes], dumper_class: type) -> None:
+    dumper = dumper_class(stream, allow_unicode=True, sort_keys=True, encoding="utf-8")
+    try:
+        dumper.open()
+        dumper.emit(DocumentStartEvent(explicit=False))
+        _emit_value(dumper, value)
+        dumper.emit(DocumentEndEvent(explicit=False))
+        dumper.close()
+    finally:
+        dumper.dispose()
+
+
+def _emit_value(dumper, value):
+    if isinstance(value, YamlDict):
+        value = escape(value._YamlDict__cache)
+    elif isinstance(value, YamlList):
+        value = value._YamlList__cache
+    if isinstance(value, Mapping):
+        dumper.emit(MappingStartEvent(None, _MAP_TAG, True, flow_style=False))
+        items = list(value.items())
+        try:
+            items.sort(key=_item_key)
+        except TypeError:
+            pass
+        for item_key, item_value in items:
+            _emit_node(dumper, dumper.represent_data(item_key))
+            _emit_value(dumper, item_value)
+        dumper.emit(MappingEndEvent())
+    elif isinstance(value, Sequence) and not isinstance(value, (str, bytes)):
+        dumper.emit(SequenceStartEvent(None, _SEQ_TAG, True, flow_style=False))
+        for item in value:
+            _emit_value(dumper, item)
+        dumper.emit(SequenceEndEvent())
+    else:
+        _emit_node(dumper, dumper.represent_data(value))
+
+
+def _emit_node(dumper, node):
+    if isinstance(node, ScalarNode):
+        detected_tag = dumper.resolve(ScalarNode, node.value, (True, False))
+        default_tag = dumper.resolve(ScalarNode, node.value, (False, True))
+        implicit = (node.tag == detected_tag), (node.tag == default_tag)
+        dumper.emit(ScalarEvent(None, node.tag, implicit, node.value, node.style))
+    elif isinstance(node, SequenceNode):
+        implicit = node.tag == dumper.resolve(SequenceNode, node.value, True)
+        dumper.emit(SequenceStartEvent(None, node.tag, implicit, node.flow_style))
+        for item in node.value:
+            _emit_node(dumper, item)
+        dumper.emit(SequenceEndEvent())
+    elif isinstance(node, MappingNode):
+        implicit = node.tag == dumper.resolve(MappingNode, node.value, True)
+        dumper.emit(MappingStartEvent(None, node.tag, implicit, node.flow_style))
+        for key, value in node.value:
+            _emit_node(dumper, key)
+            _emit_node(dumper, value)
+        dumper.emit(MappingEndEvent())
+
+
+def _item_key(item):
+    return item[0]
+
+
+_MAP_TAG = "tag:yaml.org,2002:map"
+_SEQ_TAG = "tag:yaml.org,2002:seq"
+_STR_TAG = "tag:yaml.org,2002:str"
+_NOT_SET = object()
+
+
+class _Unsupported(Exception):
+    pass
+
+
+# Same result as `list(yaml.load_all(stream, Loader=loader_class))`, but PyYAML would
+# compose the node graph of the whole document before constructing the objects, which
+# takes several times the memory of the objects. This builds them from the events,
+# only the scalars are composed. Less common YAML features (e.g. merge keys, tagged
+# collections) are left to PyYAML.
+def load_yaml(source: Callable[[], Any], loader_class: type) -> list:
+    loader = loader_class(source())
+    try:
+        return _construct_documents(loader)
+    except _Unsupported:
+        pass
+    finally:
+        loader.dispose()
+    return list(yaml.load_all(source(), Loader=loader_class))
+
+
+def _construct_documents(loader):  # pylint: disable=too-many-branches
+    documents = []
+    stack: list[list] = []  # The open collections and their pending keys
+    anchors: dict[str, Any] = {}
+    while True:
+        event = loader.get_event()
+        if isinstance(event, ScalarEvent):
+            value = _construct_scalar(loader, event)
+            if event.anchor is not None:
+                anchors[event.anchor] = value
+        elif isinstance(event, (MappingStartEvent, SequenceStartEvent)):
+            if event.tag not in (None, "!", _MAP_TAG, _SEQ_TAG):
+                raise _Unsupported
+            collection: Any = {} if isinstance(event, MappingStartEvent) else []
+            if event.anchor is not None:
+                anchors[event.anchor] = collection
+            stack.append([collection, _NOT_SET])
+            continue
+        elif isinstance(event, (MappingEndEvent, SequenceEndEvent)):
+            value = stack.pop()[0]
+        elif isinstance(event, AliasEvent):
+            if event.anchor not in anchors:
+                raise _Unsupported  # PyYAML raises the error
+            value = anchors[event.anchor]
+        elif isinstance(event, StreamEndEvent):
+            return documents
+        else:
+            if isinstance(event, DocumentStartEvent):
+                anchors = {}
+            continue
+        if not stack:
+            documents.append(value)
+            continue
+        parent = stack[-1]
+        if isinstance(parent[0], list):
+            parent[0].append(value)
+        elif parent[1] is _NOT_SET:
+            if isinstance(value, (dict, list)):
+                raise _Unsupported  # Unhashable key
+            parent[1] = value
+        else:
+            parent[0][parent[1]] = value
+            parent[1] = _NOT_SET
+
+
+def _construct_scalar(loader, event):
+    tag = event.tag
+    if tag is None or tag == "!":
+        tag = loader.resolve(ScalarNode, event.value, event.implicit)
+    if tag == _STR_TAG:
+        return event.value
+    constructor = loader.yaml_constructors.get(tag)
+    if constructor is None or tag.endswith((":merge", ":value")):
+        raise _Unsupported
+    node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, event.style)
+    return constructor(loader, node)
+
+
+# Yields the documents of the state file, with the offset where each one ends.
+# Journal records are single line JSON, so they skip the (slow) YAML parser.
+# An unparsable last record was not written completely, it is dropped, and the
+# last offset is less than the length of the data then. If the snapshot is already
+# known, only the journal after it is parsed.
+def parse_documents(  # pylint: disable=too-many-branches
+    data: bytes, loader: type = yaml.SafeLoader, journal_start: Optional[int] = None
+) -> Iterator[tuple[int, Any]]:
+    if journal_start is not None:
+        if journal_start == len(data):
+            return
+        start = journal_start + len(SEPARATOR)
+    else:
+        start = data.rfind(LAST_VALID_STATE)
+        if start >= 0:
+            # The vacuum was interrupted, the safety copy is the last valid state
+            start += len(SEPARATOR)
+        else:
+            start = 0
+    is_head = journal_start is None
+    while True:
+        end = data.find(SEPARATOR, start)
+        is_last = end < 0
+        if is_last:
+            end = len(data)
+        prefix = data[start : min(start + _PREFIX_SIZE, end)]
+        if is_last and prefix.startswith(INCOMPLETE_STATE[len(SEPARATOR) :]):
+            return  # The process was killed during vacuum, before the safety copy
+        if not is_head and prefix.startswith(BINARY_JOURNAL[len(SEPARATOR) :]):
+            # The rest of the file is binary, it may contain separators
+            start += len(BINARY_JOURNAL) - len(SEPARATOR)
+            yield start, None
+            yield from parse_binary_records(data, start)
+            return
+        if prefix[:1] == b"[" and not is_head:
+            chunk = data[start:end]
+            record, record_end = _decode_json_record(chunk)
+            # There may be garbage after the last record, e.g. if the process
+            # was killed at the beginning of a vacuum
+            if record is not None and (record_end == len(chunk) or is_last):
+                yield start + record_end, record
+                if is_last:
+                    return
+                start = end + len(SEPARATOR)
+                is_head = False
+                continue
+        try:
+            documents = load_yaml(
+                functools.partial(_yaml_source, data, start, end), loader
+            )
+        except yaml.YAMLError as error:
+            if is_head or not is_last:
+                raise
+            logger.warning(f"Dropping incomplete last record: {error}")
+            return
+        for document in documents or [None]:
+            yield end, document
+        if is_last:
+            return
+        start = end + len(SEPARATOR)
+        is_head = False
+
+
+def _yaml_source(data, start, end):
+    if end - start < _STREAM_THRESHOLD:
+        return data[start:end]
+    return _ChunkReader(data, start, end)
+
+
+class _ChunkReader:  # pylint: disable=too-few-public-methods
+    # A file-like view of a part of the data (e.g. a memory mapped file)
+    def __init__(self, data, start, end):
+        self.__data = data
+        self.__position = start
+        self.__end = end
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.__end - self.__position
+        start = self.__position
+        self.__position = min(start + size, self.__end)
+        return self.__data[start : self.__position]
+
+
+# The end of the complete records, the last one may be still being written
+def complete_records_end(data: bytes) -> int:
+    if BINARY_JOURNAL in data:
+        return len(data)  # Incomplete binary records are recognized by the parser
+    start = data.rfind(SEPARATOR)
+    if start < 0:
+        return len(data)
+    chunk = data[start + len(SEPARATOR) :]
+    record, record_end = _decode_json_record(chunk)
+    if record is None or record_end < len(chunk):
+        return start
+    return len(data)
+
+
+def _decode_json_record(chunk: bytes) -> tuple[Any, int]:
+    try:
+        text = chunk.decode("utf-8")
+        record, text_end = _json_decoder.raw_decode(text)
+    except ValueError:
+        return None, 0
+    if text[text_end:].strip():
+        return record, len(text[:text_end].encode("utf-8"))
+    return record, len(chunk)
+
+
+def encode_value(value: Any, binary: bool) -> str:
+    return json.dumps(
+        value,
+        cls=CustomJsonEncoder,
+        ensure_ascii=False,
+        separators=(",", ":") if binary else None,
+    )
+
+
+# The JSON of the last argument may be passed, if it is already encoded
+def encode_text_record(args: tuple, value_text: Optional[str] = None) -> str:
+    if value_text is None:
+        return encode_value([*args], False)
+    return f"{encode_value([*args[:-1]], False)[:-1]}, {value_text}]"
+
+
+def encode_binary_record(args: tuple, value_text: Optional[str] = None) -> bytes:
+    if value_text is None:
+        text = encode_value(args[1:], True)[1:-1]
+    else:
+        text = f"{encode_value(args[1:-1], True)[1:-1]},{value_text}"
+    return _OPCODES[args[0]] + text.encode("utf-8")
+
+
+def encode_binary_batch(payloads: list[bytes]) -> bytes:
+    return _OPCODES["batch"] + b"".join(
+        _encode_varint(len(payload)) + payload for payload in payloads
+    )
+
+
+def frame_binary_record(payload: bytes) -> bytes:
+    return _encode_varint(len(payload)) + _CRC.pack(zlib.crc32(payload)) + payload
+
+
+def decode_binary_record(payload: bytes) -> list:
+    operation = _OPERATIONS[payload[0]]
+    if operation != "batch":
+        return [operation, *_json_decoder.decode(f"[{payload[1:].decode('utf-8')}]")]
+    steps = []
+    start = 1
+    while start < len(payload):
+        length, start = _decode_varint(payload, start)
+        steps.append(decode_binary_record(payload[start : start + length]))
+        start += length
+    return ["batch", steps]
+
+
+# Yields the binary records from the offset, with the offset where each one ends.
+# Stops at the first incomplete record, or at the first one with a wrong checksum.
+def parse_binary_records(data: bytes, start: int = 0) -> Iterator[tuple[int, Any]]:
+    data_size = len(data)
+    while start < data_size:
+        length = data[start]
+        if length < 0x80:
+            crc_start = start + 1
+        else:
+            try:
+                length, crc_start = _decode_varint(data, start)
+            except IndexError:
+                return
+        payload_start = crc_start + _CRC.size
+        payload_end = payload_start + length
+        if payload_end > data_size:
+            return  # Not written completely (yet)
+        payload = data[payload_start:payload_end]
+        if zlib.crc32(payload) != _CRC.unpack_from(data, crc_start)[0]:
+            logger.warning(f"Dropping the journal from a corrupt record at {start}")
+            return
+        yield payload_end, decode_binary_record(payload)
+        start = payload_end
+
+
+def _encode_varint(value: int) -> bytes:
+    result = bytearray()
+    while value >= 0x80:
+        result.append(value & 0x7F | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def _decode_varint(data: bytes, start: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[start]
+        start += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, start
+        shift += 7
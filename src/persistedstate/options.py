@@ -0,0 +1,45 @@
+from typing import Any, Callable, NamedTuple, Optional
+
+
+class FsyncEvery(NamedTuple):
+    records: int
+
+
+class FsyncInterval(NamedTuple):
+    milliseconds: float
+
+
+class WriteBehind(NamedTuple):
+    milliseconds: float = 50
+    operations: int = 1000
+
+
+class VacuumPolicy(NamedTuple):
+    # Compact the journal when it is larger than this ratio of the snapshot
+    journal_ratio: float = 2.0
+    # ... but not if it is smaller than this
+    min_journal_bytes: int = 64 * 1024
+    # Compact the journal when replaying it on load would take longer than this
+    replay_budget_milliseconds: float = 100
+
+
+class Follow(NamedTuple):
+    # Apply the changes written by another process this often
+    milliseconds: float = 100
+    # Called with the state after the changes were applied
+    on_change: Optional[Callable[[Any], None]] = None
+
+
+class WriterThread(NamedTuple):
+    # Every change waits until the writer thread has written it, and synced it to
+    # the disk unless the durability is "flush". Waiting threads share the writes.
+    wait: bool = False
+
+
+class BlobStore(NamedTuple):
+    # Assigned strings of at least this many characters are written to their own
+    # file, and loaded when they are accessed
+    min_length: int = 64 * 1024
+    # An unreferenced blob is removed by the first vacuum this long after a vacuum
+    # found it unreferenced, followers may still read the values they loaded
+    grace_seconds: float = 3600
@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import os
+import pathlib
+import threading
+import urllib.parse
+import zlib
+from collections.abc import MutableMapping
+from typing import Iterator, Optional, Union
+
+from persistedstate.core import AttributeAccess, MappedYaml
+from persistedstate.file_handler import CHECKPOINT_SUFFIX
+from persistedstate.types import JsonType
+
+logger = logging.getLogger(__name__)
+
+_SUFFIX = ".state"
+# A shard is named by the start of its quoted key in lowercase, and a hash of the
+# key, so that names differing in case or only after the start don't collide
+_NAME_PREFIX_LENGTH = 64
+
+
+class ShardedPersistedState(AttributeAccess, MutableMapping):
+    # Every top-level key (or hash bucket of keys) is stored in its own state file
+    # in the directory, with its own journal, lock and vacuum
+    def __init__(
+        self,
+        _directory: Union[str, os.PathLike],
+        _buckets: Optional[int] = None,
+        **defaults,
+    ):
+        options = {
+            key[1:]: defaults.pop(key) for key in list(defaults) if key.startswith("_")
+        }
+        if _buckets is not None and _buckets < 1:
+            raise ValueError(f"Invalid number of buckets: {_buckets}")
+        if options.get("follow") is not None:
+            # A follower would not notice shards created later
+            raise ValueError("Follow mode is not supported for sharded state")
+        if options.get("multiprocess"):
+            # Neither would the other processes, and an empty shard is removed
+            # on close without catching up with them
+            raise ValueError("Multi-process mode is not supported for sharded state")
+        self.__directory = pathlib.Path(_directory)
+        self.__directory.mkdir(parents=True, exist_ok=True)
+        self.__buckets = _buckets
+        self.__options = options
+        self.__shards: dict[str, MappedYaml] = {}
+        self.__lock = threading.Lock()  # Only for creating shards
+        for path in sorted(self.__directory.glob("*" + _SUFFIX)):
+            name = path.name[: -len(_SUFFIX)]
+            shard = MappedYaml(path, **options)
+            self.__shards[name] = shard
+            for key in shard:
+                if self.__shard_name(key) != name:
+                    self.close()
+                    raise ValueError(
+                        f"Key {key!r} in {path} belongs to another shard,"
+                        " the directory was written with other buckets"
+                    )
+        for key, value in defaults.items():
+            self.setdefault(key, value)
+
+    def __shard_name(self, key):
+        if self.__buckets is None:
+            prefix = urllib.parse.quote(str(key), safe="").lower()
+            digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8)
+            return f"{prefix[:_NAME_PREFIX_LENGTH]}-{digest.hexdigest()}"
+        return f"bucket-{zlib.crc32(str(key).encode('utf-8')) % self.__buckets:04d}"
+
+    def __shard(self, key, create=False):
+        name = self.__shard_name(key)
+        shard = self.__shards.get(name)
+        if shard is None and create:
+            with self.__lock:
+                shard = self.__shards.get(name)
+                if shard is None:
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"New shard {name}")
+                    path = self.__directory / (name + _SUFFIX)
+                    shard = MappedYaml(path, **self.__options)
+                    self.__shards[name] = shard
+        return shard
+
+    def __getitem__(self, __key: str) -> JsonType:
+        shard = self.__shard(__key)
+        if shard is None:
+            raise KeyError(__key)
+        return shard[__key]
+
+    def __setitem__(self, __key: str, __value: JsonType) -> None:
+        self.__shard(__key, create=True)[__key] = __value
+
+    def __delitem__(self, __key: str) -> None:
+        shard = self.__shard(__key)
+        if shard is None:
+            raise KeyError(__key)
+        del shard[__key]
+
+    def __iter__(self) -> Iterator[str]:
+        for shard in list(self.__shards.values()):
+            yield from list(shard)
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in list(self.__shards.values()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def shard(self, key) -> Optional[MappedYaml]:
+        return self.__shard(key)
+
+    def flush(self):
+        for shard in list(self.__shards.values()):
+            shard.flush()
+
+    def vacuum(self):
+        for shard in list(self.__shards.values()):
+            shard.vacuum()
+
+    def _stats(self):
+        return {name: shard._stats() for name, shard in list(self.__shards.items())}
+
+    def close(self):
+        with self.__lock:
+            for name, shard in self.__shards.items():
+                empty = len(shard) == 0
+                shard.close()
+                if empty and self.__buckets is None:
+                    # The key was deleted, don't leave its files behind
+                    for suffix in (_SUFFIX, _SUFFIX + CHECKPOINT_SUFFIX):
+                        (self.__directory / (name + suffix)).unlink(missing_ok=True)
+            self.__shards.clear()
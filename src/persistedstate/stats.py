@@ -0,0 +1,119 @@
+import threading
+import time
+from typing import Any, Callable, Optional
+
+# Durations are counted in power of two buckets of microseconds, the last bucket
+# is for everything longer than about 18 minutes
+_NUM_OF_BUCKETS = 31
+
+
+class Histogram:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * _NUM_OF_BUCKETS
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        bucket = int(seconds * 1_000_000).bit_length()
+        self.buckets[min(bucket, _NUM_OF_BUCKETS - 1)] += 1
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "max_seconds": self.max,
+            # Counts by the upper bound of the bucket
+            "buckets": {
+                f"<{2**bucket}us": count
+                for bucket, count in enumerate(self.buckets)
+                if count
+            },
+        }
+
+
+class Stats:  # pylint: disable=too-many-instance-attributes
+    # Updated while holding the lock of the file handler (or its file lock), so
+    # counting is cheap enough to be always on
+    def __init__(self, hook: Optional[Callable[[str, float], None]] = None):
+        self.records_written = 0
+        self.changes_written = 0
+        self.bytes_written = 0
+        self.vacuum_bytes = 0
+        self.replayed_records = 0
+        self.lock_acquisitions = 0
+        self.blobs_written = 0
+        self.__histograms = {
+            name: Histogram()
+            for name in ("flush", "fsync", "vacuum", "load", "replay", "lock_wait")
+        }
+        self.__hook = hook
+
+    def measure(self, name: str, seconds: float) -> None:
+        self.__histograms[name].add(seconds)
+        if self.__hook is not None:
+            self.__hook(name, seconds)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "records_written": self.records_written,
+            "changes_written": self.changes_written,
+            "bytes_written": self.bytes_written,
+            "vacuum_bytes": self.vacuum_bytes,
+            "replayed_records": self.replayed_records,
+            "lock_acquisitions": self.lock_acquisitions,
+            "blobs_written": self.blobs_written,
+            **{
+                name: histogram.as_dict()
+                for name, histogram in self.__histograms.items()
+            },
+        }
+
+
+class TimedLock:
+    # A reentrant lock, which measures the time spent waiting for it. Only a
+    # contended acquisition is timed. The optional callback is called when the
+    # current thread has released it completely.
+    def __init__(self, stats: Stats, on_release: Optional[Callable[[], None]] = None):
+        self.__lock = threading.RLock()
+        self.__stats = stats
+        self.__on_release = on_release
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self.__lock.acquire(False):
+            self.__stats.lock_acquisitions += 1
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        if not self.__lock.acquire(True, timeout):
+            return False
+        self.__stats.lock_acquisitions += 1
+        self.__stats.measure("lock_wait", time.perf_counter() - start)
+        return True
+
+    __enter__ = acquire
+
+    def release(self) -> None:
+        self.__lock.release()
+        if self.__on_release is not None and not self.__lock._is_owned():
+            self.__on_release()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    # Used by threading.Condition, to release a lock acquired recursively
+
+    def _is_owned(self):
+        return self.__lock._is_owned()  # type: ignore[attr-defined]
+
+    def _release_save(self):
+        return self.__lock._release_save()  # type: ignore[attr-defined]
+
+    def _acquire_restore(self, state):
+        self.__lock._acquire_restore(state)  # type: ignore[attr-defined]
@@ -1,33 +1,127 @@
+import array
+import bisect
 import json
+import operator
+import re
 from collections.abc import Mapping, MutableMapping, MutableSequence, Sequence
 from typing import Iterator, Union
 
 JsonType = Union[MutableMapping, MutableSequence, str, int, float, bool, None]
 
+# In the file, a dict of the single key "$blob" is a reference to a blob. A dict
+# of a single key of "$" characters and "blob" is written with one more "$", and
+# read without it. The plain (not wrapped) values are kept as written in the file.
+BLOB_KEY = "$blob"
+_ESCAPED_KEY = re.compile(r"\$+blob")
+
+
+class BlobReference(dict):
+    # Created for a stored blob, so it is not escaped
+    __slots__ = ()
+
+
+def escape(value: dict) -> dict:
+    if len(value) == 1:
+        key = next(iter(value))
+        if isinstance(key, str) and _ESCAPED_KEY.fullmatch(key):
+            return {"$" + key: value[key]}
+    return value
+
+
+def unescape(value: dict) -> dict:
+    if len(value) == 1:
+        key = next(iter(value))
+        if isinstance(key, str) and key[:2] == "$$" and _ESCAPED_KEY.fullmatch(key):
+            return {key[1:]: value[key]}
+    return value
+
+
+def escape_value(value):
+    # A copy of a value of the user with its dicts escaped, the JSON encoder
+    # escapes the wrappers
+    if isinstance(value, BlobReference) or _is_wrapper(value):
+        return value
+    if isinstance(value, Mapping):
+        return escape({key: escape_value(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return [escape_value(item) for item in value]
+    return value
+
 
 class YamlDict(MutableMapping):
-    def __init__(self, file_handler, path, initial_dict):
+    __slots__ = ("__file_handler", "__cache", "__epoch", "_parent", "_key")
+
+    def __init__(self, file_handler, parent, key, initial_dict):
         self.__file_handler = file_handler
-        self.__path = path
-        self.__cache = {}
-        self.__lock = file_handler.lock
-        for key, value in initial_dict.items():
-            self.__cache[key] = convert(self.__file_handler, self.__path + [key], value)
+        self._parent = parent
+        self._key = key
+        # Nested dicts and lists are stored plain, and wrapped on first access
+        self.__cache = dict(initial_dict)
+        # The snapshot epoch of the last change, the cache may be in a snapshot
+        self.__epoch = -1
 
     def __setitem__(self, __key: str, __value: JsonType) -> None:
-        with self.__lock:
-            self.__file_handler.record_change("set", self.__path, __key, __value)
-            return self.__cache.__setitem__(
-                __key, convert(self.__file_handler, self.__path + [__key], __value)
-            )
+        with self.__file_handler.lock:
+            if _is_wrapper(__value) and self.__cache.get(__key) is __value:
+                return None  # assigned back after an augmented assignment
+            value = self.__file_handler.record_change("set", self, __key, __value)
+            cache = self.__writable_cache()
+            _detach(cache.get(__key))
+            return cache.__setitem__(__key, value)
 
     def __delitem__(self, __key: str) -> None:
-        with self.__lock:
-            self.__file_handler.record_change("delete", self.__path, __key)
-            return self.__cache.__delitem__(__key)
+        with self.__file_handler.lock:
+            self.__file_handler.record_change("delete", self, __key)
+            _detach(self.__writable_cache().pop(__key))
 
     def __getitem__(self, __key: str) -> JsonType:
-        return self.__cache.__getitem__(__key)
+        value = self.__cache.__getitem__(__key)
+        if isinstance(value, (dict, list)):
+            with self.__file_handler.lock:  # Other threads must get the same wrapper
+                value = self.__cache[__key]
+                if isinstance(value, (dict, list)):
+                    content = self.__file_handler.load_blob(value)
+                    if content is not None:
+                        return content  # not kept in memory
+                    value = convert(self.__file_handler, self, __key, value)
+                    self.__cache[__key] = value
+        return value
+
+    # The methods below are journaled as a single record, instead of a record for
+    # every changed item
+
+    def incr(self, key: str, amount: Union[int, float] = 1) -> Union[int, float]:
+        with self.__file_handler.changing():
+            # Checked before being recorded, the sum is taken from the cache as
+            # changed by the other processes
+            if not isinstance(self.__cache[key], (int, float)) or not isinstance(
+                amount, (int, float)
+            ):
+                raise TypeError(f"Cannot increment {key!r} by {amount!r}")
+            self.__file_handler.record_change("incr", self, key, amount)
+            cache = self.__writable_cache()
+            value = cache[key] = cache[key] + amount
+            return value
+
+    def update(self, other=(), /, **kwargs) -> None:
+        items = dict(other, **kwargs)
+        if not items:
+            return
+        with self.__file_handler.lock:
+            items = self.__file_handler.record_change("update", self, items)
+            cache = self.__writable_cache()
+            for key, value in items.items():
+                _detach(cache.get(key))
+                cache[key] = value
+
+    def clear(self) -> None:
+        with self.__file_handler.lock:
+            if not self.__cache:
+                return
+            self.__file_handler.record_change("clear", self)
+            for value in self.__cache.values():
+                _detach(value)
+            self.__writable_cache().clear()
 
     def __iter__(self) -> Iterator[JsonType]:
         return self.__cache.__iter__()
@@ -35,76 +129,465 @@ class YamlDict(MutableMapping):
     def __len__(self) -> int:
         return self.__cache.__len__()
 
+    def _child_key(self, child):
+        return child._key
+
+    def __writable_cache(self):
+        if self.__epoch != self.__file_handler.snapshot_epoch:
+            self.__cache, self.__epoch = _copy_on_write(
+                self.__file_handler, self, self.__cache, self.__epoch
+            )
+        return self.__cache
+
 
 class YamlList(MutableSequence):
-    def __init__(self, file_handler, path, initial_list):
+    __slots__ = ("__file_handler", "__cache", "__epoch", "__labels", "_parent", "_key")
+
+    def __init__(self, file_handler, parent, key, initial_list):
         self.__file_handler = file_handler
-        self.__path = path
-        self.__cache = []
-        self.__lock = file_handler.lock
-        for item in initial_list:
-            self.__cache.append(
-                convert(self.__file_handler, self.__path + [len(self.__cache)], item)
-            )
+        self._parent = parent
+        self._key = key
+        # Nested dicts and lists are stored plain, and wrapped on first access
+        self.__cache = list(initial_list)
+        # The snapshot epoch of the last change, the cache may be in a snapshot
+        self.__epoch = -1
+        # The children know their labels instead of their indices, which would
+        # change on insertion and deletion. The labels are ascending, so the
+        # index of a child is found by bisection. They are created when the
+        # first child is wrapped.
+        self.__labels = None
 
     def __setitem__(self, index: int, item: JsonType) -> None:
         if isinstance(index, slice):
-            raise TypeError("Slice assignment is not supported")
-        with self.__lock:
-            self.__file_handler.record_change("set", self.__path, index, item)
-            return self.__cache.__setitem__(
-                index, convert(self.__file_handler, self.__path + [index], item)
-            )
+            self.__set_slice(index, item)
+            return None
+        with self.__file_handler.lock:
+            if _is_wrapper(item) and self.__cache[index] is item:
+                return None  # assigned back after an augmented assignment
+            item = self.__file_handler.record_change("set", self, index, item)
+            cache = self.__writable_cache()
+            _detach(cache[index])
+            return cache.__setitem__(index, item)
 
     def __delitem__(self, index: int) -> None:
         if isinstance(index, slice):
-            raise TypeError("Slice deletion is not supported")
-        with self.__lock:
-            self.__file_handler.record_change("delete", self.__path, index)
-            self.__cache.__delitem__(index)
-            depth = len(self.__path)
-            for i in range(index, len(self.__cache)):
-                _update_path_index(self.__cache[i], depth, -1)
+            self.__delete_slice(index)
+            return
+        with self.__file_handler.lock:
+            self.__file_handler.record_change("delete", self, index)
+            _detach(self.__writable_cache().pop(index))
+            if self.__labels is not None:
+                del self.__labels[index]
 
     def __getitem__(self, index: int) -> JsonType:
-        return self.__cache.__getitem__(index)
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.__cache)))]
+        value = self.__cache.__getitem__(index)
+        if isinstance(value, (dict, list)):
+            with self.__file_handler.lock:  # Other threads must get the same wrapper
+                value = self.__cache[index]
+                if isinstance(value, (dict, list)):
+                    content = self.__file_handler.load_blob(value)
+                    if content is not None:
+                        return content  # not kept in memory
+                    if self.__labels is None:
+                        self.__labels = _new_labels(len(self.__cache))
+                    label = self.__labels[index]
+                    value = convert(self.__file_handler, self, label, value)
+                    self.__cache[index] = value
+        return value
 
     def __len__(self) -> int:
         return self.__cache.__len__()
 
     def insert(self, index, value):
-        with self.__lock:
-            depth = len(self.__path)
-            for i in range(index, len(self.__cache)):
-                _update_path_index(self.__cache[i], depth, 1)
-            self.__file_handler.record_change("insert", self.__path, index, value)
-            return self.__cache.insert(
-                index, convert(self.__file_handler, self.__path + [index], value)
+        with self.__file_handler.lock:
+            value = self.__file_handler.record_change("insert", self, index, value)
+            cache = self.__writable_cache()
+            # Clamp the index like list.insert() does
+            index = min(
+                max(index + len(cache) if index < 0 else index, 0),
+                len(cache),
             )
+            if self.__labels is not None:
+                self.__labels.insert(index, self.__new_label(index))
+            return cache.insert(index, value)
 
+    # The methods below are journaled as a single record, instead of a record for
+    # every changed item
 
-def convert(file_handler, path, value: JsonType):
-    if isinstance(value, Mapping):
-        return YamlDict(file_handler, path, value)
-    if isinstance(value, str):
-        return value
-    if isinstance(value, Sequence):
-        return YamlList(file_handler, path, value)
+    def append(self, value: JsonType) -> None:
+        with self.__file_handler.lock:
+            value = self.__file_handler.record_change("append", self, value)
+            cache = self.__writable_cache()
+            if self.__labels is not None:
+                self.__labels.append(self.__new_label(len(cache)))
+            cache.append(value)
+
+    def extend(self, values) -> None:
+        values = list(values)
+        if not values:
+            return
+        with self.__file_handler.lock:
+            values = self.__file_handler.record_change("extend", self, values)
+            cache = self.__writable_cache()
+            for value in values:
+                if self.__labels is not None:
+                    self.__labels.append(self.__new_label(len(cache)))
+                cache.append(value)
+
+    def clear(self) -> None:
+        with self.__file_handler.lock:
+            if not self.__cache:
+                return
+            self.__file_handler.record_change("clear", self)
+            for item in self.__cache:
+                _detach(item)
+            self.__writable_cache().clear()
+            self.__labels = None
+
+    def __set_slice(self, index: slice, values) -> None:
+        values = list(values)
+        bounds = _slice_bounds(index)
+        with self.__file_handler.changing():
+            start, stop, step = index.indices(len(self.__cache))
+            size = len(range(start, stop, step))
+            if step != 1 and len(values) != size:
+                # Checked before being recorded
+                raise ValueError(
+                    f"attempt to assign sequence of size {len(values)}"
+                    f" to extended slice of size {size}"
+                )
+            values = self.__file_handler.record_change(
+                "set_slice", self, bounds, values
+            )
+            cache = self.__writable_cache()
+            for item in cache[index]:
+                _detach(item)
+            cache[index] = values
+            if self.__labels is not None and step == 1:
+                self.__relabel()  # items were inserted or removed
+
+    def __delete_slice(self, index: slice) -> None:
+        bounds = _slice_bounds(index)
+        with self.__file_handler.changing():
+            if not self.__cache[index]:
+                return
+            self.__file_handler.record_change("delete_slice", self, bounds)
+            cache = self.__writable_cache()
+            for item in cache[index]:
+                _detach(item)
+            del cache[index]
+            if self.__labels is not None:
+                del self.__labels[index]
+
+    def __new_label(self, index):
+        labels = self.__labels
+        if not labels:
+            return 0
+        if index == len(labels):
+            if labels[-1] >= _MAX_LABEL - _LABEL_GAP:
+                self.__relabel()
+            return labels[-1] + _LABEL_GAP
+        if index == 0:
+            if labels[0] <= -_MAX_LABEL + _LABEL_GAP:
+                self.__relabel()
+            return labels[0] - _LABEL_GAP
+        if labels[index] - labels[index - 1] < 2:
+            self.__relabel()
+        return (labels[index - 1] + labels[index]) // 2
+
+    def __relabel(self):
+        labels = self.__labels
+        labels[:] = _new_labels(len(self.__cache))
+        for label, item in zip(labels, self.__cache):
+            if isinstance(item, (YamlDict, YamlList)):
+                item._key = label
+
+    def __writable_cache(self):
+        if self.__epoch != self.__file_handler.snapshot_epoch:
+            self.__cache, self.__epoch = _copy_on_write(
+                self.__file_handler, self, self.__cache, self.__epoch
+            )
+        return self.__cache
+
+    def _child_key(self, child):
+        index = bisect.bisect_left(self.__labels, child._key)
+        if index == len(self.__cache) or self.__cache[index] is not child:
+            raise ValueError(f"{child!r} is not in the list")
+        return index
+
+
+# Gap between the labels of consecutive list items, so many items can be
+# inserted between them before relabeling
+_LABEL_GAP = 2**32
+_MAX_LABEL = 2**63 - 1
+
+
+def _new_labels(length):
+    # Stored as 64 bit integers, which take much less memory than int objects
+    return array.array("q", range(0, length * _LABEL_GAP, _LABEL_GAP))
+
+
+def _slice_bounds(index: slice) -> list:
+    # Recorded as given, the list has the same length when the record is replayed
+    return [
+        None if bound is None else operator.index(bound)
+        for bound in (index.start, index.stop, index.step)
+    ]
+
+
+# Parent of values removed from the state, changing them is not recorded
+_DETACHED = object()
+# Parent of values removed while loading, by the records of another process or
+# by reloading the state without them, changing them raises LookupError
+_REMOVED_ELSEWHERE = object()
+
+
+def convert(file_handler, parent, key, value: JsonType):
+    if isinstance(value, dict):
+        return YamlDict(file_handler, parent, key, unescape(value))
+    if isinstance(value, list):
+        return YamlList(file_handler, parent, key, value)
+    return value
+
+
+def node_path(node):
+    path = []
+    while node._parent is not None:
+        if node._parent is _DETACHED or node._parent is _REMOVED_ELSEWHERE:
+            return None
+        path.append(node._parent._child_key(node))
+        node = node._parent
+    path.reverse()
+    return path
+
+
+def removed_elsewhere(node):
+    # Whether the value was removed by another process, not by this one
+    while node._parent is not None and node._parent is not _DETACHED:
+        if node._parent is _REMOVED_ELSEWHERE:
+            return True
+        node = node._parent
+    return False
+
+
+def clear_for_reload(root) -> dict:
+    # Returns the wrappers of the top-level values, to be refilled from the
+    # reloaded state by refill_after_reload()
+    children = {
+        key: value for key, value in root._YamlDict__cache.items() if _is_wrapper(value)
+    }
+    root.clear()
+    return children
+
+
+def refill_after_reload(root, children: dict) -> None:
+    # The wrappers of the values still in the reloaded state take their new
+    # content, so the dicts and lists held by the user read and change the
+    # reloaded state. The others stay removed.
+    cache = root._YamlDict__writable_cache()
+    for key, child in children.items():
+        if _refill(child, cache.get(key)):
+            child._parent = root
+            cache[key] = child
+
+
+def _refill(node, value) -> bool:
+    # Whether the value has the kind of the node. The wrapped children are
+    # refilled with the value at their key or index.
+    if isinstance(node, YamlDict):
+        file_handler = node._YamlDict__file_handler
+        if not isinstance(value, dict) or file_handler.load_blob(value) is not None:
+            return False
+        cache = node._YamlDict__writable_cache()
+        children = {key: item for key, item in cache.items() if _is_wrapper(item)}
+        cache.clear()
+        cache.update(unescape(value))
+        for key, child in children.items():
+            if _refill(child, cache.get(key)):
+                cache[key] = child
+            else:
+                child._parent = _REMOVED_ELSEWHERE
+        return True
+    if not isinstance(value, list):
+        return False
+    cache = node._YamlList__writable_cache()
+    children = [(index, item) for index, item in enumerate(cache) if _is_wrapper(item)]
+    cache[:] = value
+    kept = []
+    for index, child in children:
+        if index < len(cache) and _refill(child, cache[index]):
+            cache[index] = child
+            kept.append((index, child))
+        else:
+            child._parent = _REMOVED_ELSEWHERE
+    node._YamlList__labels = None
+    if kept:
+        labels = node._YamlList__labels = _new_labels(len(cache))
+        for index, child in kept:
+            child._key = labels[index]
+    return True
+
+
+def _is_wrapper(value):
+    return isinstance(value, (YamlDict, YamlList))
+
+
+def _detach(value):
+    if isinstance(value, YamlDict):
+        loading = value._YamlDict__file_handler.loading
+    elif isinstance(value, YamlList):
+        loading = value._YamlList__file_handler.loading
+    else:
+        return
+    # Only the records of other processes are applied while loading
+    value._parent = _REMOVED_ELSEWHERE if loading else _DETACHED
+
+
+class _Frozen:  # pylint: disable=too-few-public-methods
+    # The caches of the nodes changed since the snapshot was taken, with the nodes,
+    # so their ids are not reused
+    __slots__ = ("epoch", "root", "caches", "__weakref__")
+
+    def __init__(self, epoch, root):
+        self.epoch = epoch
+        self.root = root
+        self.caches = {}
+
+
+def _copy_on_write(file_handler, node, cache, epoch):
+    # Called on the first change of a node since a snapshot was taken (or since it
+    # was wrapped). The snapshots taken since its last change keep the cache, the
+    # node continues with a copy. Returns the cache and epoch of the node.
+    kept = False
+    for frozen in file_handler.snapshots:
+        if frozen.epoch > epoch:
+            frozen.caches[id(node)] = (node, cache)
+            kept = True
+    return (cache.copy() if kept else cache), file_handler.snapshot_epoch
+
+
+def take_snapshot(file_handler, root):
+    # Called with the lock held. The caches are not copied, the nodes changed
+    # later copy their own cache on their first change.
+    file_handler.snapshot_epoch += 1
+    frozen = _Frozen(file_handler.snapshot_epoch, root._YamlDict__cache)
+    file_handler.snapshots.add(frozen)
+    return FrozenDict(frozen, file_handler, frozen.root)
+
+
+def _frozen_cache(frozen, node):
+    # The cache is read first: a node stores it in the snapshot before replacing it
+    if isinstance(node, YamlDict):
+        cache = node._YamlDict__cache
+    else:
+        cache = node._YamlList__cache
+    return frozen.caches.get(id(node), (None, cache))[1]
+
+
+def _frozen_value(frozen, file_handler, value):
+    if isinstance(value, YamlDict):
+        return FrozenDict(frozen, file_handler, _frozen_cache(frozen, value))
+    if isinstance(value, YamlList):
+        value = _frozen_cache(frozen, value)
+    if isinstance(value, dict):
+        content = file_handler.load_blob(value)
+        if content is not None:
+            return content
+        return FrozenDict(frozen, file_handler, unescape(value))
+    if isinstance(value, list):
+        return FrozenList(frozen, file_handler, value)
+    return value
+
+
+class FrozenDict(Mapping):
+    # A read-only view of a dict in a snapshot, it does not change with the state
+    __slots__ = ("__frozen", "__file_handler", "__cache")
+
+    def __init__(self, frozen, file_handler, cache):
+        self.__frozen = frozen
+        self.__file_handler = file_handler
+        self.__cache = cache
+
+    def __getitem__(self, __key: str) -> JsonType:
+        return _frozen_value(
+            self.__frozen, self.__file_handler, self.__cache.__getitem__(__key)
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        return self.__cache.__iter__()
+
+    def __len__(self) -> int:
+        return self.__cache.__len__()
+
+
+class FrozenList(Sequence):
+    # A read-only view of a list in a snapshot, it does not change with the state
+    __slots__ = ("__frozen", "__file_handler", "__cache")
+
+    def __init__(self, frozen, file_handler, cache):
+        self.__frozen = frozen
+        self.__file_handler = file_handler
+        self.__cache = cache
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.__cache)))]
+        return _frozen_value(
+            self.__frozen, self.__file_handler, self.__cache.__getitem__(index)
+        )
+
+    def __len__(self) -> int:
+        return self.__cache.__len__()
+
+
+def copy_snapshot(snapshot: FrozenDict) -> dict:
+    # A plain copy, with the blob references instead of their content
+    return escape(
+        _copy_frozen(snapshot._FrozenDict__frozen, snapshot._FrozenDict__cache)
+    )
+
+
+def copy_live_snapshots(file_handler) -> list[dict]:
+    # Plain copies of the snapshots which are still used
+    return [
+        escape(_copy_frozen(frozen, frozen.root))
+        for frozen in list(file_handler.snapshots)
+    ]
+
+
+def _copy_frozen(frozen, value):
+    if isinstance(value, YamlDict):
+        return escape(_copy_frozen(frozen, _frozen_cache(frozen, value)))
+    if isinstance(value, YamlList):
+        value = _frozen_cache(frozen, value)
+    if isinstance(value, dict):
+        return {key: _copy_frozen(frozen, item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_frozen(frozen, item) for item in value]
     return value
 
 
-def _update_path_index(obj, depth, delta):
+def unwrap(obj):
+    # The same data without the wrappers, sharing the plain values, so it must not
+    # be changed. Plain values contain no wrappers, they are wrapped on access.
     if isinstance(obj, YamlDict):
-        obj._YamlDict__path[depth] += delta
-        for child in obj._YamlDict__cache.values():
-            _update_path_index(child, depth, delta)
-    elif isinstance(obj, YamlList):
-        obj._YamlList__path[depth] += delta
-        for child in obj._YamlList__cache:
-            _update_path_index(child, depth, delta)
+        return escape(
+            {key: unwrap(value) for key, value in obj._YamlDict__cache.items()}
+        )
+    if isinstance(obj, YamlList):
+        return [unwrap(item) for item in obj._YamlList__cache]
+    return obj
 
 
 def convert_to_json_like(obj):
+    if isinstance(obj, YamlDict):
+        obj = obj._YamlDict__cache
+    elif isinstance(obj, YamlList):
+        obj = obj._YamlList__cache
+    elif isinstance(obj, dict):
+        obj = unescape(obj)  # a plain value, as written in the file
     if isinstance(obj, str):
         return obj
     if isinstance(obj, Mapping):
@@ -117,7 +600,12 @@ def convert_to_json_like(obj):
 class CustomJsonEncoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, YamlDict):
-            return o._YamlDict__cache
+            return escape(o._YamlDict__cache)
         if isinstance(o, YamlList):
             return o._YamlList__cache
+        # A value of a snapshot, as it was when the snapshot was taken
+        if isinstance(o, FrozenDict):
+            return copy_snapshot(o)
+        if isinstance(o, FrozenList):
+            return _copy_frozen(o._FrozenList__frozen, o._FrozenList__cache)
         return o
@@ -0,0 +1,136 @@
+import asyncio
+import pathlib
+import threading
+
+import pytest
+
+from persistedstate import AsyncPersistedState, PersistedState, VacuumPolicy
+from persistedstate import file_handler
+
+# Vacuum after 10 counter increments
+VACUUM_OFTEN = VacuumPolicy(journal_ratio=0, min_journal_bytes=300)
+
+
+class TestAsyncPersistedState:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/aio.state")
+        self.filepath.unlink(missing_ok=True)
+
+    def journal(self):
+        return self.filepath.read_text(encoding="utf-8").split("\n---\n")[1:]
+
+    @pytest.fixture
+    def blocked_writer(self, monkeypatch):
+        armed = threading.Event()
+        started = threading.Event()
+        resume = threading.Event()
+        original_dump_yaml = file_handler.dump_yaml
+
+        def dump_yaml(*args):
+            if armed.is_set() and threading.current_thread().name.startswith(
+                "persistedstate-writer"
+            ):
+                started.set()
+                resume.wait(timeout=10)
+            original_dump_yaml(*args)
+
+        monkeypatch.setattr(file_handler, "dump_yaml", dump_yaml)
+        return armed, started, resume
+
+    def test_flush(self):
+        async def run():
+            async with await AsyncPersistedState.open(
+                self.filepath, counter=0
+            ) as state:
+                await state.avacuum()
+                for _ in range(3):
+                    state.counter += 1
+                assert state.counter == 3
+                await state.aflush()
+                assert len(self.journal()) == 3
+
+        asyncio.run(run())
+        with PersistedState(self.filepath) as state:
+            assert state.counter == 3
+
+    def test_commit_syncs(self, monkeypatch):
+        synced = []
+        monkeypatch.setattr(file_handler.os, "fsync", synced.append)
+
+        async def run():
+            async with await AsyncPersistedState.open(
+                self.filepath, counter=0
+            ) as state:
+                state.counter += 1
+                await state.acommit()
+                assert synced
+                assert self.journal()[-1] == '["set", [], "counter", 1]'
+
+        asyncio.run(run())
+
+    def test_changes_during_vacuum(self, blocked_writer):
+        armed, started, resume = blocked_writer
+
+        async def run():
+            async with AsyncPersistedState(
+                self.filepath, _vacuum_policy=VACUUM_OFTEN, counter=0, list=[]
+            ) as state:
+                await state.avacuum()
+                armed.set()
+                with state._thread_lock:  # Not vacuumed in the meantime
+                    for _ in range(11):
+                        state.counter += 1
+                assert await asyncio.to_thread(started.wait, 10)
+                # The writer thread is vacuuming, changes are not blocked
+                for index in range(5):
+                    state.list.append(index)
+                resume.set()
+                await state.aflush()
+                assert self.filepath.read_text(encoding="utf-8").startswith(
+                    "counter: 11\nlist: []\n---\n"
+                )
+                assert len(self.journal()) == 5
+
+        asyncio.run(run())
+        with PersistedState(self.filepath) as state:
+            assert state.counter == 11
+            assert list(state.list) == [0, 1, 2, 3, 4]
+
+    def test_open_outside_of_the_event_loop(self, monkeypatch):
+        with PersistedState(self.filepath, counter=1):
+            pass
+        loaded_in = []
+        original_parse_documents = file_handler.parse_documents
+
+        def parse_documents(*args):
+            loaded_in.append(threading.current_thread())
+            return original_parse_documents(*args)
+
+        monkeypatch.setattr(file_handler, "parse_documents", parse_documents)
+
+        async def run():
+            state = await AsyncPersistedState.open(self.filepath, counter=0)
+            assert state.counter == 1
+            assert loaded_in and threading.current_thread() not in loaded_in
+            state.counter += 1
+            await state.aclose()
+
+        asyncio.run(run())
+        with PersistedState(self.filepath) as state:
+            assert state.counter == 2
+
+    def test_transaction(self):
+        async def run():
+            async with await AsyncPersistedState.open(
+                self.filepath, counter=0
+            ) as state:
+                await state.avacuum()
+                with state.transaction():
+                    state.counter += 1
+                    state.name = "name"
+                await state.aflush()
+                assert self.journal() == [
+                    '["batch", [["set", [], "counter", 1], ["set", [], "name", "name"]]]'
+                ]
+
+        asyncio.run(run())
@@ -0,0 +1,91 @@
+import pathlib
+import threading
+
+import pytest
+
+from persistedstate import PersistedState, VacuumPolicy
+from persistedstate import file_handler
+
+# Vacuum after 10 counter increments
+VACUUM_OFTEN = VacuumPolicy(journal_ratio=0, min_journal_bytes=300)
+
+
+class TestBackgroundVacuum:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/background_vacuum.state")
+        self.filepath.unlink(missing_ok=True)
+
+    @pytest.fixture
+    def blocked_vacuum(self, monkeypatch):
+        started = threading.Event()
+        resume = threading.Event()
+        original_dump_yaml = file_handler.dump_yaml
+
+        def dump_yaml(*args):
+            if threading.current_thread().name.startswith("persistedstate-vacuum"):
+                started.set()
+                resume.wait(timeout=10)
+            original_dump_yaml(*args)
+
+        monkeypatch.setattr(file_handler, "dump_yaml", dump_yaml)
+        return started, resume
+
+    def wait_for_vacuum(self, state):
+        vacuum_thread = state._MappedYaml__file_handler._FileHandler__vacuum_thread
+        if vacuum_thread is not None:
+            vacuum_thread.join()
+
+    def test_changes_during_vacuum(self, blocked_vacuum):
+        started, resume = blocked_vacuum
+        with PersistedState(
+            self.filepath,
+            _background_vacuum=True,
+            _vacuum_policy=VACUUM_OFTEN,
+            counter=0,
+            list=[],
+        ) as state:
+            state.vacuum()
+            for _ in range(11):
+                state.counter += 1
+            assert started.wait(timeout=10)
+            for index in range(5):
+                state.list.append(index)
+            resume.set()
+            self.wait_for_vacuum(state)
+            content = self.filepath.read_text(encoding="utf-8")
+            assert content.startswith("counter: 10\nlist: []\n---\n")
+            assert content.count("\n---\n") == 6
+            state.counter += 1
+            with PersistedState(self.filepath) as copy:
+                assert copy.counter == 12
+                assert list(copy.list) == [0, 1, 2, 3, 4]
+
+    def test_vacuum_on_close(self, blocked_vacuum):
+        started, resume = blocked_vacuum
+        with PersistedState(
+            self.filepath,
+            _background_vacuum=True,
+            _vacuum_policy=VACUUM_OFTEN,
+            counter=0,
+        ) as state:
+            state.vacuum()
+            for _ in range(11):
+                state.counter += 1
+            assert started.wait(timeout=10)
+            resume.set()
+        assert self.filepath.read_text(encoding="utf-8") == "counter: 11"
+        assert not self.filepath.with_name(self.filepath.name + ".vacuum").exists()
+
+    def test_many_changes(self):
+        with PersistedState(
+            self.filepath,
+            _background_vacuum=True,
+            _vacuum_policy=VACUUM_OFTEN,
+            counter=0,
+        ) as state:
+            for _ in range(1000):
+                state.counter += 1
+            self.wait_for_vacuum(state)
+            assert self.filepath.read_text(encoding="utf-8").count("\n---\n") < 1000
+        with PersistedState(self.filepath) as state:
+            assert state.counter == 1000
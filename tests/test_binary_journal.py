@@ -0,0 +1,136 @@
+import logging
+import pathlib
+import shutil
+
+import pytest
+import yaml
+
+from persistedstate import Follow, PersistedState
+from persistedstate.journal import BINARY_JOURNAL
+
+
+class TestBinaryJournal:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/binary_journal.state")
+        self.copy = pathlib.Path("tmp/binary_journal.copy")
+        self.filepath.unlink(missing_ok=True)
+
+    def open(self, filepath=None, **options):
+        return PersistedState(
+            filepath or self.filepath, _journal_format="binary", **options
+        )
+
+    def crash_copy(self):
+        # The file as left behind by a crash
+        shutil.copy(self.filepath, self.copy)
+
+    def test_replay(self):
+        with self.open(counter=0, entries=[]) as state:
+            state.counter += 1
+            state.entries.append({"id": 1, "name": "ünicode"})
+            state.entries.insert(0, {"id": 0})
+            with state.transaction():
+                state.entries[1]["done"] = True
+                del state.entries[0]
+                state.counter += 1
+            self.crash_copy()
+        assert BINARY_JOURNAL in self.copy.read_bytes()
+        with PersistedState(self.copy) as state:
+            assert state.counter == 2
+            assert [dict(entry) for entry in state.entries] == [
+                {"id": 1, "name": "ünicode", "done": True}
+            ]
+        # Vacuumed on close, the file is plain YAML again
+        assert yaml.safe_load(self.filepath.read_bytes()) == {
+            "counter": 2,
+            "entries": [{"id": 1, "name": "ünicode", "done": True}],
+        }
+
+    def test_smaller_than_text(self):
+        sizes = {}
+        for journal_format in ("text", "binary"):
+            self.filepath.unlink(missing_ok=True)
+            with PersistedState(
+                self.filepath, _journal_format=journal_format, counter=0
+            ) as state:
+                for _ in range(100):
+                    state.counter += 1
+                sizes[journal_format] = self.filepath.stat().st_size
+        assert sizes["binary"] < sizes["text"] * 0.8
+
+    def test_torn_tail(self):
+        with self.open(counter=0) as state:
+            state.counter = 1
+            state.counter = 2
+            self.crash_copy()
+        data = self.copy.read_bytes()
+        for cut in range(1, 8):
+            self.copy.write_bytes(data[:-cut])
+            with PersistedState(self.copy) as state:
+                assert state.counter == 1
+
+    def test_corrupt_record(self, caplog):
+        with self.open(counter=0) as state:
+            for value in range(1, 5):
+                state.counter = value
+            self.crash_copy()
+        data = bytearray(self.copy.read_bytes())
+        # The records set the counter to 0, 1, 2, ..., corrupt the one setting 2
+        position = data.index(BINARY_JOURNAL) + len(BINARY_JOURNAL)
+        for _ in range(2):
+            position += data[position] + 5
+        data[position + data[position] + 4] ^= 1
+        self.copy.write_bytes(data)
+        with caplog.at_level(logging.WARNING):
+            with PersistedState(self.copy) as state:
+                assert state.counter == 1
+        assert "corrupt record" in caplog.text
+
+    def test_switch_format(self):
+        with PersistedState(self.filepath, counter=0) as state:
+            state.counter = 1
+            self.crash_copy()
+        # Binary records are appended to the text journal
+        with self.open(self.copy) as state:
+            assert state.counter == 1
+            state.counter = 2
+            shutil.copy(self.copy, self.filepath)
+        with PersistedState(self.filepath) as state:
+            assert state.counter == 2
+            # Text records cannot follow the binary journal
+            assert BINARY_JOURNAL not in self.filepath.read_bytes()
+            state.counter = 3
+        with PersistedState(self.filepath) as state:
+            assert state.counter == 3
+
+    def test_invalid_format(self):
+        with pytest.raises(ValueError):
+            PersistedState(self.filepath, _journal_format="json")
+
+    def test_multiprocess_catch_up(self):
+        with (
+            self.open(_multiprocess=True, entries=[]) as first,
+            self.open(_multiprocess=True) as second,
+        ):
+            first.counter = 1
+            second.entries.append({"id": 1})
+            with first.transaction():
+                first.entries.append({"id": 2})
+            with second.transaction():
+                second.counter += 1
+            assert first.refresh()
+            assert first.counter == 2
+            assert [dict(entry) for entry in first.entries] == [{"id": 1}, {"id": 2}]
+
+    def test_follow(self):
+        with self.open(counter=0) as writer:
+            follower = PersistedState(
+                self.filepath, _follow=Follow(milliseconds=60_000)
+            )
+            writer.counter = 1
+            assert follower.refresh()
+            assert follower.counter == 1
+            writer.counter = 2
+            assert follower.refresh()
+            assert follower.counter == 2
+            follower.close()
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import pathlib
+import shutil
+
+import pytest
+
+from persistedstate import BlobStore, Follow, PersistedState
+from persistedstate.types import convert_to_json_like
+
+SMALL_BLOBS = BlobStore(min_length=100)
+NO_GRACE = BlobStore(min_length=100, grace_seconds=0)
+LARGE = "large value " * 100
+
+
+def digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def close_without_vacuum(state):
+    state._MappedYaml__file_handler._FileHandler__file.close()
+
+
+class TestBlobStore:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/blobs.state")
+        self.blobs = pathlib.Path("tmp/blobs.state.blobs")
+        self.filepath.unlink(missing_ok=True)
+        shutil.rmtree(self.blobs, ignore_errors=True)
+
+    @pytest.mark.parametrize("journal_format", ["text", "binary"])
+    def test_large_values_are_stored_once(self, journal_format):
+        with PersistedState(
+            self.filepath,
+            _blob_store=SMALL_BLOBS,
+            _journal_format=journal_format,
+            list=[],
+            config={},
+        ) as state:
+            state.value = LARGE
+            state.list.append(LARGE)
+            state.list.extend(["small", LARGE + "!"])
+            state.config.update(key=LARGE)
+            assert state.value == state.list[0] == state.config["key"] == LARGE
+            assert state.list[1:] == ["small", LARGE + "!"]
+            assert state._stats()["blobs_written"] == 2
+            assert sorted(path.name for path in self.blobs.iterdir()) == sorted(
+                [digest(LARGE), digest(LARGE + "!")]
+            )
+            assert LARGE.encode("utf-8") not in self.filepath.read_bytes()
+            close_without_vacuum(state)
+        # Replayed from the journal, and then from the snapshot
+        for _ in range(2):
+            with PersistedState(self.filepath, _blob_store=SMALL_BLOBS) as state:
+                assert state.value == LARGE
+                assert list(state.list) == [LARGE, "small", LARGE + "!"]
+                assert dict(state.config) == {"key": LARGE}
+                assert convert_to_json_like(state)["value"] == {"$blob": digest(LARGE)}
+        assert LARGE.encode("utf-8") not in self.filepath.read_bytes()
+
+    def test_unreferenced_blobs_are_removed(self):
+        with PersistedState(
+            self.filepath, _blob_store=NO_GRACE, first=LARGE, second=LARGE + "!"
+        ) as state:
+            state.list = []
+            state.list.append(LARGE)
+            (self.blobs / "interrupted.tmp").write_bytes(b"")
+            del state["first"]
+            state.vacuum()
+            assert sorted(path.name for path in self.blobs.iterdir()) == sorted(
+                [digest(LARGE), digest(LARGE + "!")]
+            )
+            state.list.clear()
+            state.second = "small"
+        assert not self.blobs.exists()
+
+    def test_grace_period(self):
+        with PersistedState(self.filepath, _blob_store=SMALL_BLOBS) as state:
+            state.first = LARGE
+            state.second = LARGE + "!"
+            state.first = state.second = "small"
+            state.vacuum()  # found unreferenced
+            state.second = LARGE + "!"  # referenced again
+            state.vacuum()
+            assert sorted(path.name for path in self.blobs.iterdir()) == sorted(
+                [digest(LARGE), digest(LARGE) + ".unreferenced", digest(LARGE + "!")]
+            )
+            found = self.blobs / (digest(LARGE) + ".unreferenced")
+            os.utime(found, (0, 0))  # found unreferenced before the grace period
+            state.vacuum()
+            assert [path.name for path in self.blobs.iterdir()] == [digest(LARGE + "!")]
+
+    def test_follower_reads_removed_values(self):
+        with PersistedState(
+            self.filepath, _blob_store=SMALL_BLOBS, large=LARGE
+        ) as writer:
+            follower = PersistedState(
+                self.filepath,
+                _blob_store=SMALL_BLOBS,
+                _follow=Follow(milliseconds=60_000),
+            )
+            assert follower.large == LARGE
+            writer.large = LARGE + "!"
+            writer.vacuum()
+        assert follower.large == LARGE  # not refreshed yet
+        assert follower.refresh()
+        assert follower.large == LARGE + "!"
+        follower.close()
+
+    def test_opened_without_the_option(self):
+        with PersistedState(self.filepath, _blob_store=SMALL_BLOBS) as state:
+            state.value = LARGE
+            state.list = [LARGE]
+        for _ in range(2):
+            with PersistedState(self.filepath) as state:
+                assert state.value == state.list[0] == LARGE
+                state.other = LARGE  # stored inline
+        assert sorted(path.name for path in self.blobs.iterdir()) == [digest(LARGE)]
+        with PersistedState(self.filepath, _blob_store=SMALL_BLOBS) as state:
+            assert state.value == state.other == LARGE
+
+    def test_small_and_nested_values(self):
+        with PersistedState(self.filepath, _blob_store=SMALL_BLOBS) as state:
+            state.small = "small"
+            state.nested = {"key": LARGE}  # the dict is assigned, not the string
+            state.nested["other"] = LARGE
+        assert sorted(path.name for path in self.blobs.iterdir()) == [digest(LARGE)]
+        with PersistedState(self.filepath, _blob_store=SMALL_BLOBS) as state:
+            assert state.small == "small"
+            assert dict(state.nested) == {"key": LARGE, "other": LARGE}
+
+    def test_invalid_references(self):
+        # Not a file name of a blob, so these are plain dicts
+        values = [{"$blob": "../blobs.state"}, {"$blob": 1}, {"$blob": "", "a": 1}]
+        with PersistedState(self.filepath, _blob_store=SMALL_BLOBS) as state:
+            state.refs = values
+            assert convert_to_json_like(state.refs) == values
+
+    @pytest.mark.parametrize("journal_format", ["text", "binary"])
+    def test_user_dicts_like_references(self, journal_format):
+        # Escaped in the file, so these are not read as blob references
+        like = {"$blob": digest(LARGE)}
+        values = [like, {"$$blob": 1}, {"$blob": {"$blob": "a" * 64}}]
+        with PersistedState(
+            self.filepath, _blob_store=SMALL_BLOBS, _journal_format=journal_format
+        ) as state:
+            state.like = like
+            state.refs = values
+            state.config = {}
+            state.config.update({"$blob": "a" * 64})
+            state.config["nested"] = {}
+            state.config["nested"]["$blob"] = "b" * 64
+            snapshot = state.snapshot()
+            assert state.like == like
+            assert convert_to_json_like(state.refs) == values
+            assert convert_to_json_like(snapshot["refs"]) == values
+            close_without_vacuum(state)
+        expected = {
+            "like": like,
+            "refs": values,
+            "config": {"$blob": "a" * 64, "nested": {"$blob": "b" * 64}},
+        }
+        # Replayed from the journal, and then from the snapshot
+        for _ in range(2):
+            with PersistedState(self.filepath, _blob_store=SMALL_BLOBS) as state:
+                assert convert_to_json_like(state) == expected
+                assert state.config["nested"] == {"$blob": "b" * 64}
+        assert not self.blobs.exists()
+
+    def test_invalid_option(self):
+        with pytest.raises(ValueError):
+            PersistedState(self.filepath, _blob_store=100)
@@ -0,0 +1,98 @@
+import pathlib
+
+import pytest
+
+from persistedstate import PersistedState, VacuumPolicy, journal
+from persistedstate.types import convert_to_json_like
+
+# Vacuum after 10 counter increments
+VACUUM_OFTEN = VacuumPolicy(journal_ratio=0, min_journal_bytes=300)
+
+
+def close_without_vacuum(state):
+    state._MappedYaml__file_handler._FileHandler__file.close()
+
+
+class TestCheckpoint:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/checkpoint.state")
+        self.checkpoint = pathlib.Path("tmp/checkpoint.state.checkpoint")
+        self.filepath.unlink(missing_ok=True)
+        self.checkpoint.unlink(missing_ok=True)
+
+    @staticmethod
+    def forbid_yaml_parser(monkeypatch):
+        def load_yaml(*args):
+            raise AssertionError("The YAML parser was used")
+
+        monkeypatch.setattr(journal, "load_yaml", load_yaml)
+
+    def create(self, **options):
+        with PersistedState(
+            self.filepath, _checkpoint=True, **options, list=[], config={}
+        ) as state:
+            state.list.extend({"id": index} for index in range(100))
+            state.config["nested"] = {"key": "value"}
+            state.list[0]["changed"] = True  # wrapped values
+        return convert_to_json_like(state)
+
+    @pytest.mark.parametrize("journal_format", ["text", "binary"])
+    def test_load_from_checkpoint(self, monkeypatch, journal_format):
+        expected = self.create(_journal_format=journal_format)
+        assert self.checkpoint.exists()
+        self.forbid_yaml_parser(monkeypatch)
+        state = PersistedState(
+            self.filepath, _checkpoint=True, _journal_format=journal_format
+        )
+        assert convert_to_json_like(state) == expected
+        # The journal after the snapshot is replayed
+        state.list.append("new")
+        state.config.clear()
+        close_without_vacuum(state)
+        with PersistedState(
+            self.filepath, _checkpoint=True, _journal_format=journal_format
+        ) as state:
+            assert state.list[-1] == "new"
+            assert not state.config
+            assert len(state.list) == 101
+
+    def test_edited_file(self):
+        self.create()
+        text = self.filepath.read_text(encoding="utf-8")
+        self.filepath.write_text(text.replace("value", "VALUE"), encoding="utf-8")
+        with PersistedState(self.filepath, _checkpoint=True) as state:
+            assert state.config["nested"]["key"] == "VALUE"
+        # Written again on close
+        with PersistedState(self.filepath, _checkpoint=True) as state:
+            assert state.config["nested"]["key"] == "VALUE"
+
+    @pytest.mark.parametrize("content", [b"", b"garbage", b"\xe3\x01\x00\x00\x00"])
+    def test_damaged_checkpoint(self, content):
+        expected = self.create()
+        self.checkpoint.write_bytes(content)
+        with PersistedState(self.filepath, _checkpoint=True) as state:
+            assert convert_to_json_like(state) == expected
+
+    @pytest.mark.parametrize("mode", ["_background_vacuum", "_writer_thread"])
+    def test_vacuum_in_thread(self, monkeypatch, mode):
+        state = PersistedState(
+            self.filepath,
+            _checkpoint=True,
+            _vacuum_policy=VACUUM_OFTEN,
+            **{mode: True},
+            counter=0,
+        )
+        for _ in range(25):
+            state.counter += 1
+        file_handler = state._MappedYaml__file_handler
+        # The writer thread vacuums after the waiters of the batch are done
+        file_handler.barrier(vacuum=mode == "_writer_thread").result()
+        vacuum_thread = file_handler._FileHandler__vacuum_thread
+        if vacuum_thread is not None:
+            vacuum_thread.join()
+        assert self.checkpoint.exists()
+        close_without_vacuum(state)
+        self.forbid_yaml_parser(monkeypatch)
+        state = PersistedState(self.filepath, _checkpoint=True)
+        assert state.counter == 25
+        close_without_vacuum(state)
@@ -0,0 +1,58 @@
+import os
+import pathlib
+import time
+
+import pytest
+
+from persistedstate import FsyncEvery, FsyncInterval, PersistedState
+
+
+class TestDurability:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/durability.state")
+        self.filepath.unlink(missing_ok=True)
+
+    @pytest.fixture
+    def fsync_calls(self, monkeypatch):
+        calls = []
+        original_fsync = os.fsync
+
+        def fsync(fd):
+            calls.append(fd)
+            original_fsync(fd)
+
+        monkeypatch.setattr(os, "fsync", fsync)
+        return calls
+
+    def count_to(self, durability, count):
+        with PersistedState(self.filepath, _durability=durability, counter=0) as state:
+            for _ in range(count):
+                state.counter += 1
+        with PersistedState(self.filepath) as state:
+            assert state.counter == count
+
+    def test_flush(self, fsync_calls):
+        self.count_to("flush", 10)
+        assert not fsync_calls
+
+    def test_fsync(self, fsync_calls):
+        self.count_to("fsync", 10)
+        assert len(fsync_calls) >= 11
+
+    def test_fsync_every(self, fsync_calls):
+        self.count_to(FsyncEvery(5), 10)
+        assert len(fsync_calls) >= 2
+        assert len(fsync_calls) < 11
+
+    def test_fsync_interval(self, fsync_calls):
+        with PersistedState(self.filepath, _durability=FsyncInterval(10)) as state:
+            state.counter = 1
+            time.sleep(0.2)
+            assert fsync_calls
+            fsync_calls.clear()
+            time.sleep(0.05)
+            assert not fsync_calls
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            PersistedState(self.filepath, _durability="always")
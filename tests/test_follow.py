@@ -0,0 +1,90 @@
+import os
+import pathlib
+
+import pytest
+
+from persistedstate import Follow, PersistedState
+
+# Refreshed only explicitly by the tests
+NO_POLLING = Follow(milliseconds=60_000)
+
+
+class TestFollow:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/follow.state")
+        self.filepath.unlink(missing_ok=True)
+
+    def test_follow_changes(self):
+        with PersistedState(self.filepath, counter=0, entries=[]) as writer:
+            follower = PersistedState(self.filepath, _follow=NO_POLLING)
+            assert follower.counter == 0
+            writer.counter = 1
+            writer.entries.append({"id": 1})
+            writer.entries.insert(0, {"id": 0})
+            assert follower.refresh()
+            assert follower.counter == 1
+            assert [dict(entry) for entry in follower.entries] == [
+                {"id": 0},
+                {"id": 1},
+            ]
+            assert not follower.refresh()
+            follower.close()
+
+    def test_read_only(self):
+        with PersistedState(self.filepath, counter=0):
+            pass
+        content = self.filepath.read_bytes()
+        with PersistedState(self.filepath, _follow=NO_POLLING) as follower:
+            with pytest.raises(TypeError):
+                follower.counter = 1
+            with pytest.raises(TypeError):
+                follower.vacuum()
+            assert follower.counter == 0
+        assert self.filepath.read_bytes() == content
+
+    def test_vacuum_by_writer(self):
+        with PersistedState(self.filepath, counter=0) as writer:
+            follower = PersistedState(self.filepath, _follow=NO_POLLING)
+            for _ in range(10):
+                writer.counter += 1
+            assert follower.refresh()
+            writer.vacuum()
+            writer.counter += 1
+            assert follower.refresh()
+            assert follower.counter == 11
+            follower.close()
+
+    def test_replaced_file(self):
+        with PersistedState(self.filepath, counter=0) as writer:
+            writer.counter = 1
+        with PersistedState(self.filepath, _follow=NO_POLLING) as follower:
+            temp_path = self.filepath.with_suffix(".new")
+            temp_path.write_text("counter: 2\n", encoding="utf-8")
+            os.replace(temp_path, self.filepath)
+            assert follower.refresh()
+            assert follower.counter == 2
+
+    def test_incomplete_record(self):
+        with PersistedState(self.filepath, counter=0):
+            pass
+        with PersistedState(self.filepath, _follow=NO_POLLING) as follower:
+            with self.filepath.open("ab") as file:
+                file.write(b'\n---\n["set", [], "counter", 1')
+                file.flush()
+                assert not follower.refresh()
+                file.write(b"]")
+            assert follower.refresh()
+            assert follower.counter == 1
+
+    def test_wait_for_change(self):
+        changes = []
+        with PersistedState(self.filepath, counter=0) as writer:
+            with PersistedState(
+                self.filepath,
+                _follow=Follow(milliseconds=10, on_change=changes.append),
+            ) as follower:
+                assert not follower.wait_for_change(timeout=0.05)
+                writer.counter = 1
+                assert follower.wait_for_change(timeout=10)
+                assert follower.counter == 1
+                assert changes == [follower]
@@ -0,0 +1,98 @@
+import pathlib
+import textwrap
+
+from persistedstate import PersistedState, journal
+from persistedstate.file_handler import FileHandler
+
+
+class TestJournal:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/journal.state")
+        self.filepath.unlink(missing_ok=True)
+
+    def load(self, content):
+        self.filepath.write_bytes(textwrap.dedent(content).lstrip().encode("utf-8"))
+        return PersistedState(self.filepath)
+
+    def test_hand_edited_records(self):
+        with self.load("""
+            counter: 1
+            list: []
+            ---
+            ["set", [], "counter", 2]
+            ---
+            - insert
+            - [list]
+            - 0
+            - {a: A}
+            ---
+            ["set", ["list", 0], "b", "B"] # comment
+            """) as state:
+            assert state.counter == 2
+            assert dict(state.list[0]) == {"a": "A", "b": "B"}
+
+    def test_incomplete_last_record(self):
+        with self.load("""
+            counter: 1
+            ---
+            ["set", [], "counter", 2]
+            ---
+            ["set", [], "coun""") as state:
+            assert state.counter == 2
+            state.counter = 3
+        with PersistedState(self.filepath) as state:
+            assert state.counter == 3
+
+    def test_garbage_after_last_record(self):
+        with self.load("""
+            counter: 1
+            ---
+            ["set", [], "counter", 2]counter: 1
+            """) as state:
+            assert state.counter == 2
+
+    def test_interrupted_vacuum(self):
+        with self.load("""
+            counter: 3
+            ...
+            er", 2]
+            ---
+            ["set", [], "coun
+            ---
+            ### LAST VALID STATE ###
+            counter: 3
+            """) as state:
+            assert state.counter == 3
+
+    def test_interrupted_safety_copy(self):
+        with self.load("""
+            counter: 1
+            ---
+            ["set", [], "counter", 2]
+            ---
+            ### INCOMPLETE STATE ###
+            counter: 2
+            list:
+            """) as state:
+            assert state.counter == 2
+            assert "list" not in state
+
+    def test_comment_only(self):
+        with self.load("# Nothing here yet\n") as state:
+            assert not state
+
+    def test_memory_mapped(self, monkeypatch):
+        monkeypatch.setattr(FileHandler, "_MMAP_THRESHOLD", 1)
+        monkeypatch.setattr(journal, "_STREAM_THRESHOLD", 1)
+        with self.load("""
+            counter: 1
+            list: [a, b]
+            ---
+            ["set", [], "counter", 2]
+            ---
+            ["set", [], "coun""") as state:
+            assert state.counter == 2
+            assert list(state.list) == ["a", "b"]
+            state.counter = 3
+        with PersistedState(self.filepath) as state:
+            assert state.counter == 3
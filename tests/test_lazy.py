@@ -0,0 +1,53 @@
+import pathlib
+import textwrap
+
+from persistedstate import PersistedState
+from persistedstate.types import YamlDict, YamlList
+
+
+class TestLazyWrapping:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/lazy.state")
+        self.filepath.unlink(missing_ok=True)
+
+    def test_wrapped_on_access(self):
+        with PersistedState(self.filepath) as state:
+            state.entries = [{"id": index, "tags": ["a"]} for index in range(3)]
+        with PersistedState(self.filepath) as state:
+            cache = state._YamlDict__cache
+            assert isinstance(cache["entries"], list)
+            assert isinstance(state.entries, YamlList)
+            assert isinstance(state.entries[1], YamlDict)
+            assert isinstance(state.entries._YamlList__cache[0], dict)
+            state.entries[1]["tags"].append("b")
+        with PersistedState(self.filepath) as state:
+            assert list(state.entries[1]["tags"]) == ["a", "b"]
+            assert list(state.entries[0]["tags"]) == ["a"]
+
+    def test_assigned_value_is_copied(self):
+        value = {"tags": ["a"]}
+        with PersistedState(self.filepath) as state:
+            state.first = value
+            state.second = value
+            value["tags"].append("b")
+            state.first["tags"].append("c")
+            assert list(state.second["tags"]) == ["a"]
+        with PersistedState(self.filepath) as state:
+            assert list(state.first["tags"]) == ["a", "c"]
+            assert list(state.second["tags"]) == ["a"]
+
+    def test_yaml_aliases_are_independent(self):
+        self.filepath.write_text(
+            textwrap.dedent("""
+                first: &tags
+                  tags: [a]
+                second: *tags
+                """),
+            encoding="utf-8",
+        )
+        with PersistedState(self.filepath) as state:
+            state.first["tags"].append("b")
+            assert list(state.second["tags"]) == ["a"]
+        with PersistedState(self.filepath) as state:
+            assert list(state.first["tags"]) == ["a", "b"]
+            assert list(state.second["tags"]) == ["a"]
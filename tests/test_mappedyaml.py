@@ -2,6 +2,9 @@ import pathlib
 import textwrap
 from abc import ABC, abstractmethod
 
+import pytest
+import yaml
+
 from persistedstate import PersistedState
 
 TMP_PATH = pathlib.Path("tmp")
@@ -14,19 +17,36 @@ class Base(ABC):
     file2 = pathlib.Path("tmp/test2.state")
     input_data = ""
 
-    def test_change(self):
+    @pytest.mark.parametrize(
+        "use_libyaml",
+        [
+            pytest.param(
+                True,
+                id="libyaml",
+                marks=pytest.mark.skipif(
+                    not yaml.__with_libyaml__, reason="PyYAML is built without libyaml"
+                ),
+            ),
+            pytest.param(False, id="pure-python"),
+        ],
+    )
+    def test_change(self, use_libyaml):
         self.file1.write_text(
             textwrap.dedent(self.input_data).strip(), encoding="utf-8"
         )
-        with PersistedState(self.file1) as state:
+        with PersistedState(self.file1, _use_libyaml=use_libyaml) as state:
             self.change(state)
             changed_data = self.file1.read_text(encoding="utf-8")
             (BACKUP_PATH / self.__class__.__name__).with_suffix(".yaml").write_text(
                 changed_data, encoding="utf-8"
             )
             self.file2.write_text(changed_data, encoding="utf-8")
-        with PersistedState(self.file2) as state:
+        with PersistedState(self.file2, _use_libyaml=use_libyaml) as state:
             self.assertions(state)
+        vacuumed_data = self.file2.read_bytes()
+        with PersistedState(self.file2, _use_libyaml=not use_libyaml):
+            pass
+        assert self.file2.read_bytes() == vacuumed_data
 
     @abstractmethod
     def change(self, state):
@@ -159,3 +179,58 @@ class TestInsertThenModifyNestedRef(Base):
         assert state.entries[2]["id"] == 1
         assert state.entries[2]["modified"] is True
         assert state.entries[3]["id"] == 2
+
+
+class TestQueueThenModifyNestedRef(Base):
+    """Using a list as a queue, modifying a nested object via an old reference
+    must record its current path in the journal."""
+
+    def change(self, state):
+        state.queue = [{"id": index, "tags": []} for index in range(10)]
+        ref = state.queue[5]["tags"]
+        for index in range(10, 15):
+            state.queue.append({"id": index, "tags": []})
+            del state.queue[0]
+        ref.append("head")
+
+    def assertions(self, state):
+        assert [entry["id"] for entry in state.queue] == list(range(5, 15))
+        assert list(state.queue[0]["tags"]) == ["head"]
+
+
+class TestModifyRemovedRef(Base):
+    """Modifying an object via a reference after it was removed from the state
+    must not change the state."""
+
+    def change(self, state):
+        state.entries = [{"id": 0}, {"id": 1}]
+        removed = state.entries[0]
+        replaced = state.entries[1]
+        del state.entries[0]
+        state.entries[0] = {"id": 2}
+        removed["modified"] = True
+        replaced["modified"] = True
+
+    def assertions(self, state):
+        assert len(state.entries) == 1
+        assert dict(state.entries[0]) == {"id": 2}
+
+
+class TestMiddleInsertThenModifyNestedRef(Base):
+    """Inserting many items at the same position, modifying a nested object via
+    an old reference must record its current path in the journal."""
+
+    def change(self, state):
+        state.entries = [{"id": "first"}, {"id": "last"}]
+        first, last = state.entries[0], state.entries[1]
+        for index in range(40):
+            state.entries.insert(1, {"id": index})
+        first["modified"] = True
+        last["modified"] = True
+        state.entries[1]["modified"] = True
+
+    def assertions(self, state):
+        assert len(state.entries) == 42
+        assert dict(state.entries[0]) == {"id": "first", "modified": True}
+        assert dict(state.entries[1]) == {"id": 39, "modified": True}
+        assert dict(state.entries[41]) == {"id": "last", "modified": True}
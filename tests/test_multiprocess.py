@@ -0,0 +1,133 @@
+import concurrent.futures
+import multiprocessing
+import pathlib
+
+import pytest
+
+from persistedstate import PersistedState, VacuumPolicy
+
+NUM_OF_PROCESSES = 8
+STEPS_OF_EACH_PROCESS = 50
+STATE_FILE = pathlib.Path("tmp/processes.state")
+# Vacuum after a few changes, so the processes vacuum while the others write
+VACUUM_OFTEN = VacuumPolicy(journal_ratio=0, min_journal_bytes=1000)
+
+
+def process_function(worker):
+    with PersistedState(
+        STATE_FILE, _multiprocess=True, _vacuum_policy=VACUUM_OFTEN
+    ) as state:
+        for step in range(STEPS_OF_EACH_PROCESS):
+            with state.transaction():
+                state.counter += 1
+                state.list.append(f"{worker}-{step}")
+            state[f"last_{worker}"] = step
+
+
+class TestMultiprocess:
+    def setup_method(self):
+        self.filepath = STATE_FILE
+        self.filepath.unlink(missing_ok=True)
+
+    def test_process_usage(self):
+        PersistedState(self.filepath, counter=0, list=[]).close()
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=NUM_OF_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            futures = [
+                executor.submit(process_function, worker)
+                for worker in range(NUM_OF_PROCESSES)
+            ]
+            for future in futures:
+                future.result()
+        with PersistedState(self.filepath) as state:
+            assert state.counter == NUM_OF_PROCESSES * STEPS_OF_EACH_PROCESS
+            assert sorted(state.list) == sorted(
+                f"{worker}-{step}"
+                for worker in range(NUM_OF_PROCESSES)
+                for step in range(STEPS_OF_EACH_PROCESS)
+            )
+            for worker in range(NUM_OF_PROCESSES):
+                assert state[f"last_{worker}"] == STEPS_OF_EACH_PROCESS - 1
+
+    def test_catch_up(self):
+        with (
+            PersistedState(
+                self.filepath, _multiprocess=True, entries=[{"id": 0}]
+            ) as first,
+            PersistedState(self.filepath, _multiprocess=True) as second,
+        ):
+            first.counter = 1
+            nested = second.entries[0]
+            first.entries.insert(0, {"id": 1})
+            nested["modified"] = True  # Catches up with the insertion first
+            assert [dict(item) for item in second.entries] == [
+                {"id": 1},
+                {"id": 0, "modified": True},
+            ]
+            with first.transaction():
+                assert first.entries[1]["modified"] is True
+            second.vacuum()
+            assert self.filepath.read_text(encoding="utf-8").startswith(
+                "# generation: 1\n"
+            )
+            first.counter += 1  # Reloads the file vacuumed by the other process
+            with second.transaction():
+                assert second.counter == 2
+                assert len(second.entries) == 2
+
+    def test_checked_after_catching_up(self):
+        with (
+            PersistedState(
+                self.filepath, _multiprocess=True, counter=0, list=[{"id": 0}, 1]
+            ) as first,
+            PersistedState(self.filepath, _multiprocess=True) as second,
+        ):
+            second.incr("counter")
+            second.incr("counter")
+            assert first.incr("counter") == 3
+            item = first.list[0]
+            second.list.insert(0, {"id": 1})
+            del first.list[:1]  # deletes the item inserted by the other process
+            item["changed"] = True
+            second.list.append(2)
+            with pytest.raises(ValueError):
+                first.list[::2] = ["a"]  # the list has 3 items by now
+        with PersistedState(self.filepath) as state:
+            assert state.counter == 3
+            assert [dict(state.list[0]), *state.list[1:]] == [
+                {"id": 0, "changed": True},
+                1,
+                2,
+            ]
+
+    def test_change_after_reload(self):
+        with (
+            PersistedState(
+                self.filepath, _multiprocess=True, queue=[], config={"nested": {}}
+            ) as first,
+            PersistedState(self.filepath, _multiprocess=True) as second,
+        ):
+            queue = first.queue  # wrapped before the other process vacuums
+            nested = first.config["nested"]
+            second.vacuum()
+            first.queue.append("item1")  # Reloads the file, then appends
+            queue.append("item2")  # the reloaded list
+            nested["key"] = "value"
+            assert list(queue) == ["item1", "item2"]
+            assert queue is first.queue
+            assert first.config["nested"]["key"] == "value"
+            second.queue.append({"tags": []})
+            second.vacuum()
+            queue.append({"tags": []})  # Reloads the file, then appends
+            queue[-1]["tags"].append("tag")  # the item appended by this process
+            assert [list(item["tags"]) for item in queue[2:]] == [[], ["tag"]]
+            second.vacuum()
+            del second["config"]
+            with pytest.raises(LookupError):
+                nested["key"] = "changed"  # removed by the other process
+        with PersistedState(self.filepath) as state:
+            assert state.queue[:2] == ["item1", "item2"]
+            assert [list(item["tags"]) for item in state.queue[2:]] == [[], ["tag"]]
+            assert "config" not in state
@@ -0,0 +1,126 @@
+import pathlib
+import shutil
+
+import pytest
+
+from persistedstate import PersistedState
+from persistedstate.types import convert_to_json_like
+
+
+class TestOperations:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/operations.state")
+        self.filepath.unlink(missing_ok=True)
+        self.copy = self.filepath.with_suffix(".copy")
+
+    def journal(self):
+        return self.filepath.read_text(encoding="utf-8").split("\n---\n")[1:]
+
+    def replayed(self):
+        # The journal is replayed from a copy, the state vacuums on close
+        shutil.copy(self.filepath, self.copy)
+        with PersistedState(self.copy) as state:
+            return convert_to_json_like(state)
+
+    def test_single_records(self):
+        with PersistedState(self.filepath, counter=0, config={}, list=[]) as state:
+            state.vacuum()
+            assert state.incr("counter") == 1
+            assert state.incr("counter", 2.5) == 3.5
+            state.config.update({"a": 1}, b=2)
+            state.config.clear()
+            state.list.append(1)
+            state.list.extend(range(2, 5))
+            state.list += [5]
+            state.list[1:3] = ["x"]
+            del state.list[::2]
+            state.list.clear()
+            assert self.journal() == [
+                '["incr", [], "counter", 1]',
+                '["incr", [], "counter", 2.5]',
+                '["update", ["config"], {"a": 1, "b": 2}]',
+                '["clear", ["config"]]',
+                '["append", ["list"], 1]',
+                '["extend", ["list"], [2, 3, 4]]',
+                '["extend", ["list"], [5]]',
+                '["set_slice", ["list"], [1, 3, null], ["x"]]',
+                '["delete_slice", ["list"], [null, null, 2]]',
+                '["clear", ["list"]]',
+            ]
+            expected = convert_to_json_like(state)
+        assert self.replayed() == expected == {"counter": 3.5, "config": {}, "list": []}
+
+    @pytest.mark.parametrize("journal_format", ["text", "binary"])
+    def test_replay_slices(self, journal_format):
+        with PersistedState(
+            self.filepath, _journal_format=journal_format, list=list(range(10))
+        ) as state:
+            state.vacuum()
+            state.list[2:5] = ["a", "b"]
+            state.list[::-3] = ["x", "y", "z"]
+            state.list[-1:-5:-2] = ["p", "q"]
+            del state.list[-2:]
+            state.list[1:1] = [[], {}]
+            expected = convert_to_json_like(state)
+            assert self.replayed() == expected
+
+    def test_slices_of_wrapped_items(self):
+        with PersistedState(
+            self.filepath, list=[{"id": index} for index in range(5)]
+        ) as state:
+            items = list(state.list)  # wrapped, so they have labels
+            state.list[1:3] = [{"id": "new"}, {"id": "new"}, {"id": "new"}]
+            del state.list[::3]
+            items[3]["changed"] = True
+            items[1]["changed"] = True  # removed from the state
+            state.list.append({"id": "last"})
+            state.list[-1]["changed"] = True
+            expected = convert_to_json_like(state)["list"]
+            assert expected == [
+                {"id": "new"},
+                {"id": "new"},
+                {"id": 3, "changed": True},
+                {"id": 4},
+                {"id": "last", "changed": True},
+            ]
+            assert self.replayed()["list"] == expected
+
+    def test_failed_slice_assignment(self):
+        with PersistedState(self.filepath, list=[1, 2, 3]) as state:
+            state.vacuum()
+            with pytest.raises(ValueError):
+                state.list[::2] = [1]
+            with pytest.raises(TypeError):
+                state.incr("list")
+            assert not self.journal()
+            assert list(state.list) == [1, 2, 3]
+
+    def test_bulk_extend(self):
+        with PersistedState(self.filepath, list=[]) as state:
+            state.vacuum()
+            state.list.extend({"id": index} for index in range(10_000))
+            assert len(self.journal()) == 1
+            assert len(state.list) == 10_000
+
+    @pytest.mark.parametrize("journal_format", ["text", "binary"])
+    def test_assigned_values_are_copied(self, journal_format):
+        value = {"list": [1, {"a": None}], "number": 1.5, 1: "key"}
+        with PersistedState(
+            self.filepath, _journal_format=journal_format, value={}
+        ) as state:
+            state.value = value
+            state.copy = state.value  # contains wrappers
+            state.list = []
+            state.list.extend([value, state.copy["list"]])
+            value["list"].append(2)
+            state.value["list"][1]["a"] = "changed"
+            expected = {
+                "value": {"list": [1, {"a": "changed"}], "number": 1.5, "1": "key"},
+                "copy": {"list": [1, {"a": None}], "number": 1.5, "1": "key"},
+                "list": [
+                    {"list": [1, {"a": None}], "number": 1.5, "1": "key"},
+                    [1, {"a": None}],
+                ],
+            }
+            assert convert_to_json_like(state) == expected
+            assert self.replayed() == expected
@@ -26,3 +26,28 @@ class TestAttributes:
             string: Ahoi
             """).strip()
         assert expected_state == self.filepath.read_text(encoding="utf-8").strip()
+
+
+class CounterState(PersistedState):
+    def __init__(self, filepath):
+        super().__init__(filepath, counter=0)
+        self._increments = 0
+
+    def increment(self):
+        self._increments += 1
+        self.counter += 1
+
+
+class TestSubclass:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/subclass.state")
+        self.filepath.unlink(missing_ok=True)
+
+    def test_subclass(self):
+        with CounterState(self.filepath) as state:
+            state.increment()
+            state.increment()
+            assert state._increments == 2
+        with CounterState(self.filepath) as state:
+            assert state.counter == 2
+            assert "_increments" not in state
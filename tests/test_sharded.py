@@ -0,0 +1,104 @@
+import pathlib
+import shutil
+import threading
+
+import pytest
+
+from persistedstate import ShardedPersistedState, VacuumPolicy
+
+
+class TestSharded:
+    def setup_method(self) -> None:
+        self.directory = pathlib.Path("tmp/sharded")
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_mapping_and_attributes(self):
+        with ShardedPersistedState(self.directory, counter=0, processed=[]) as state:
+            state.counter += 1
+            state.processed.append({"id": 1})
+            state["other key/with slash"] = "value"
+            assert len(state) == 3
+            assert sorted(state) == ["counter", "other key/with slash", "processed"]
+            assert "missing" not in state
+            with pytest.raises(AttributeError):
+                _ = state.missing
+            state.temporary = 1
+            del state["temporary"]
+        assert sorted(path.name for path in self.directory.iterdir()) == [
+            "counter-dc6c407cf1ca86ef.state",
+            "other%20key%2fwith%20slash-36945d1c9e298487.state",
+            "processed-c2c9c6b519870127.state",
+        ]
+        with ShardedPersistedState(self.directory, counter=10) as state:
+            assert state.counter == 1
+            assert [dict(item) for item in state.processed] == [{"id": 1}]
+            assert state["other key/with slash"] == "value"
+            assert "temporary" not in state
+
+    def test_keys_with_similar_names(self):
+        # Distinct files on case-insensitive file systems, and short enough
+        long_key = "x" * 300
+        with ShardedPersistedState(self.directory) as state:
+            state.A = 1
+            state.a = 2
+            state[long_key] = 3
+            state[long_key + "!"] = 4
+        names = [path.name for path in self.directory.iterdir()]
+        assert len({name.lower() for name in names}) == 4
+        assert max(len(name) for name in names) < 100
+        with ShardedPersistedState(self.directory) as state:
+            assert dict(state) == {"A": 1, "a": 2, long_key: 3, long_key + "!": 4}
+
+    def test_buckets(self):
+        with ShardedPersistedState(self.directory, _buckets=4) as state:
+            for i in range(100):
+                state[f"key{i}"] = i
+        assert 1 < len(list(self.directory.iterdir())) <= 4
+        with ShardedPersistedState(self.directory, _buckets=4) as state:
+            assert dict(state) == {f"key{i}": i for i in range(100)}
+        with pytest.raises(ValueError):
+            ShardedPersistedState(self.directory, _buckets=3)
+        with pytest.raises(ValueError):
+            ShardedPersistedState(self.directory, _buckets=0)
+        with pytest.raises(ValueError):
+            ShardedPersistedState(self.directory, _multiprocess=True)
+
+    def test_vacuum_only_changed_shard(self):
+        policy = VacuumPolicy(journal_ratio=1.0, min_journal_bytes=256)
+        with ShardedPersistedState(
+            self.directory,
+            _vacuum_policy=policy,
+            counter=0,
+            processed=list(range(1000)),
+        ) as state:
+            processed_content = (
+                self.directory / "processed-c2c9c6b519870127.state"
+            ).read_bytes()
+            for _ in range(100):
+                state.counter += 1
+            assert (
+                self.directory / "processed-c2c9c6b519870127.state"
+            ).read_bytes() == processed_content
+            assert (
+                len((self.directory / "counter-dc6c407cf1ca86ef.state").read_bytes())
+                < 200
+            )
+
+    def test_threads_on_different_keys(self):
+        with ShardedPersistedState(self.directory) as state:
+
+            def worker(key):
+                state[key] = 0
+                for _ in range(200):
+                    state[key] += 1
+
+            threads = [
+                threading.Thread(target=worker, args=(f"counter{i}",)) for i in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert dict(state) == {f"counter{i}": 200 for i in range(8)}
+        with ShardedPersistedState(self.directory) as state:
+            assert dict(state) == {f"counter{i}": 200 for i in range(8)}
@@ -0,0 +1,127 @@
+import gc
+import pathlib
+import shutil
+import threading
+
+import pytest
+
+from persistedstate import BlobStore, PersistedState
+from persistedstate.types import convert_to_json_like
+
+
+class TestSnapshot:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/snapshot.state")
+        self.filepath.unlink(missing_ok=True)
+        shutil.rmtree("tmp/snapshot.state.blobs", ignore_errors=True)
+
+    def test_snapshot_does_not_change(self):
+        initial = {
+            "counter": 0,
+            "config": {"nested": {"key": "value"}},
+            "list": [{"id": 1}, {"id": 2}, 3],
+        }
+        with PersistedState(self.filepath, **initial) as state:
+            wrapped = state.config["nested"]  # wrapped before the snapshot
+            snapshot = state.snapshot()
+            state.incr("counter")
+            wrapped["key"] = "changed"
+            state.config["new"] = True
+            state.list[0]["id"] = "changed"  # wrapped after the snapshot
+            state.list[1:] = [4]
+            state.list.extend([5, 6])
+            del state.config["nested"]
+            second = state.snapshot()
+            state.list.clear()
+            state.config.clear()
+            assert convert_to_json_like(snapshot) == initial
+            assert convert_to_json_like(second) == {
+                "counter": 1,
+                "config": {"new": True},
+                "list": [{"id": "changed"}, 4, 5, 6],
+            }
+            assert convert_to_json_like(state.snapshot()) == convert_to_json_like(state)
+            assert snapshot["list"][1:] == [snapshot["list"][1], 3]
+            with pytest.raises(TypeError):
+                snapshot["counter"] = 1  # type: ignore[index]
+
+    def test_restore_from_snapshot(self):
+        initial = {"config": {"nested": {"$blob": 1}}, "list": [[1], {"id": 2}]}
+        expected = {
+            "config": {"nested": {"$blob": 1}},
+            "list": [[1, 2], {"id": 2}, [1, 2]],
+            "copy": {"list": [[1, 2], {"id": 2}]},
+        }
+        with PersistedState(self.filepath, **initial) as state:
+            state.list[0].append(2)  # wrapped before the snapshot
+            snapshot = state.snapshot()
+            state.config["nested"]["key"] = "changed"
+            state.list.clear()
+            state.config = snapshot["config"]
+            state.list = snapshot["list"]
+            state.list.extend(snapshot["list"][:1])
+            state.copy = {"list": snapshot["list"]}
+            assert convert_to_json_like(state) == expected
+        with PersistedState(self.filepath) as state:
+            assert convert_to_json_like(state) == expected
+
+    def test_snapshots_are_released(self):
+        with PersistedState(self.filepath, list=[1, 2]) as state:
+            file_handler = state._MappedYaml__file_handler
+            snapshot = state.snapshot()
+            state.list.append(3)
+            assert len(file_handler.snapshots) == 1
+            del snapshot
+            gc.collect()
+            assert not file_handler.snapshots
+            state.list.append(4)
+            assert list(state.list) == [1, 2, 3, 4]
+
+    def test_read_while_changing(self):
+        records = {str(index): {"index": index} for index in range(2000)}
+        with PersistedState(self.filepath, records=records) as state:
+            stop = threading.Event()
+
+            def change():
+                index = len(records)
+                while not stop.is_set():
+                    with state.transaction():  # both or none are in a snapshot
+                        state.records[str(index)] = {"index": index}
+                        state.records[str(index - len(records))]["changed"] = True
+                    index += 1
+
+            thread = threading.Thread(target=change)
+            thread.start()
+            try:
+                for _ in range(20):
+                    # Iterating the live state would fail with "dictionary
+                    # changed size during iteration"
+                    snapshot = state.snapshot()["records"]
+                    length = len(snapshot)
+                    items = list(snapshot.items())
+                    assert len(items) == length
+                    assert all(item["index"] == int(key) for key, item in items)
+                    changed = sum("changed" in item for _, item in items)
+                    assert changed == length - len(records)
+            finally:
+                stop.set()
+                thread.join()
+
+    def test_blobs_in_snapshot(self):
+        large = "x" * 200
+        with PersistedState(
+            self.filepath,
+            _blob_store=BlobStore(min_length=100, grace_seconds=0),
+            list=[],
+        ) as state:
+            state.value = large
+            state.list.append(large)
+            snapshot = state.snapshot()
+            state.value = "small"
+            state.list.clear()
+            state.vacuum()  # keeps the blobs of the snapshot
+            assert snapshot["value"] == snapshot["list"][0] == large
+            del snapshot
+            gc.collect()
+            state.vacuum()
+            assert not pathlib.Path("tmp/snapshot.state.blobs").exists()
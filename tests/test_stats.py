@@ -0,0 +1,81 @@
+import pathlib
+import threading
+import time
+
+import pytest
+
+from persistedstate import PersistedState
+
+
+class TestStats:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/stats.state")
+        self.filepath.unlink(missing_ok=True)
+
+    def test_journal_and_vacuum(self):
+        events = []
+        with PersistedState(
+            self.filepath,
+            _durability="fsync",
+            _stats_hook=lambda name, seconds: events.append(name),
+            counter=0,
+        ) as state:
+            # The default value is the first record
+            state.vacuum()
+            size = self.filepath.stat().st_size
+            for _ in range(10):
+                state.counter += 1
+            with state.transaction():
+                state.counter += 1
+                state.counter += 1
+            stats = state._stats()
+            assert stats["records_written"] == 12
+            assert stats["changes_written"] == 13
+            assert stats["journal_bytes"] == self.filepath.stat().st_size - size
+            assert stats["journal_changes"] == 12
+            assert stats["flush"]["count"] == 12
+            assert sum(stats["flush"]["buckets"].values()) == 12
+            assert stats["fsync"]["count"] >= 12
+            assert stats["load"]["count"] == 1
+            state.vacuum()
+            stats = state._stats()
+            assert stats["vacuum"]["count"] == 2
+            assert stats["snapshot_bytes"] > 0
+            assert stats["vacuum_bytes"] > stats["snapshot_bytes"]
+            assert stats["journal_bytes"] == 0
+        assert events.count("flush") == 12
+        assert events.count("vacuum") == 3  # and on close
+
+    def test_replay(self):
+        with PersistedState(self.filepath, counter=0) as state:
+            for _ in range(5):
+                state.counter += 1
+            copy = self.filepath.with_suffix(".copy")
+            copy.write_bytes(self.filepath.read_bytes())
+        with PersistedState(copy) as state:
+            stats = state._stats()
+            assert stats["replayed_records"] == 6
+            assert stats["replay"]["count"] == 1
+
+    def test_lock_wait(self):
+        with PersistedState(self.filepath, counter=0) as state:
+            locked = threading.Event()
+
+            def hold_lock():
+                with state._thread_lock:
+                    locked.set()
+                    time.sleep(0.05)
+
+            thread = threading.Thread(target=hold_lock)
+            thread.start()
+            locked.wait()
+            state.counter += 1
+            thread.join()
+            stats = state._stats()
+            assert stats["lock_wait"]["count"] == 1
+            assert stats["lock_wait"]["max_seconds"] >= 0.02
+            assert stats["lock_acquisitions"] > 1
+
+    def test_invalid_hook(self):
+        with pytest.raises(ValueError):
+            PersistedState(self.filepath, _stats_hook="print")
@@ -3,7 +3,10 @@ import pathlib
 import shutil
 import threading
 
-from persistedstate import PersistedState
+import pytest
+
+from persistedstate import FsyncInterval, PersistedState, WriteBehind, WriterThread
+from persistedstate import file_handler
 
 NUM_OF_THREADS = 100
 STEPS_OF_EACH_THREAD = 10
@@ -44,3 +47,65 @@ class TestThreads:
     def threaded_function(self):
         for _ in range(STEPS_OF_EACH_THREAD):
             self.state.list.append(threading.get_ident())
+
+
+class TestWriterThread:
+    def setup_method(self):
+        self.filepath = pathlib.Path("tmp/writer.state")
+        self.filepath.unlink(missing_ok=True)
+
+    def journal(self):
+        return self.filepath.read_text(encoding="utf-8").split("\n---\n")[1:]
+
+    def test_changes_from_threads(self):
+        with PersistedState(self.filepath, _writer_thread=True, list=[]) as state:
+            state.vacuum()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+                for future in [
+                    executor.submit(state.list.append, index) for index in range(100)
+                ]:
+                    future.result()
+            state.flush()
+            assert len(self.journal()) == 100
+        with PersistedState(self.filepath) as state:
+            assert sorted(state.list) == list(range(100))
+
+    def test_wait_until_synced(self, monkeypatch):
+        synced = []
+        monkeypatch.setattr(file_handler.os, "fsync", synced.append)
+        with PersistedState(
+            self.filepath,
+            _durability=FsyncInterval(milliseconds=60_000),
+            _writer_thread=WriterThread(wait=True),
+            counter=0,
+        ) as state:
+            state.vacuum()
+            synced.clear()
+            state.counter += 1
+            assert synced
+            assert self.journal() == ['["set", [], "counter", 1]']
+
+    def test_wait_after_releasing_the_lock(self, monkeypatch):
+        synced = []
+        monkeypatch.setattr(file_handler.os, "fsync", synced.append)
+        with PersistedState(
+            self.filepath,
+            _durability=FsyncInterval(milliseconds=60_000),
+            _writer_thread=WriterThread(wait=True),
+            counter=0,
+        ) as state:
+            state.vacuum()
+            synced.clear()
+            with state._thread_lock:
+                state.counter += 1
+                state.counter += 1
+            assert synced
+            assert len(self.journal()) == 2
+
+    def test_wait_with_write_behind(self):
+        with pytest.raises(ValueError):
+            PersistedState(
+                self.filepath,
+                _writer_thread=WriterThread(wait=True),
+                _write_behind=WriteBehind(),
+            )
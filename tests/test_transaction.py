@@ -0,0 +1,51 @@
+import pathlib
+
+from persistedstate import PersistedState
+
+
+class TestTransaction:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/transaction.state")
+        self.filepath.unlink(missing_ok=True)
+
+    def journal(self):
+        return self.filepath.read_text(encoding="utf-8").split("\n---\n")[1:]
+
+    def test_single_record(self):
+        with PersistedState(self.filepath, counter=0, entries=[]) as state:
+            journal_length = len(self.journal())
+            with state.transaction():
+                state.counter += 1
+                state.entries.append({"a": "A"})
+                state.entries[0]["b"] = "B"
+                del state.entries[0]["a"]
+                assert len(self.journal()) == journal_length
+            assert len(self.journal()) == journal_length + 1
+            assert self.journal()[-1].startswith('["batch", ')
+            self.filepath.with_suffix(".copy").write_text(
+                self.filepath.read_text(encoding="utf-8"), encoding="utf-8"
+            )
+        with PersistedState(self.filepath.with_suffix(".copy")) as state:
+            assert state.counter == 1
+            assert [dict(item) for item in state.entries] == [{"b": "B"}]
+
+    def test_nested_transactions(self):
+        with PersistedState(self.filepath, counter=0) as state:
+            journal_length = len(self.journal())
+            with state.transaction():
+                state.counter += 1
+                with state.transaction():
+                    state.counter += 1
+                assert len(self.journal()) == journal_length
+                state.counter += 1
+            assert len(self.journal()) == journal_length + 1
+        with PersistedState(self.filepath) as state:
+            assert state.counter == 3
+
+    def test_incomplete_batch_is_dropped(self):
+        self.filepath.write_text(
+            'counter: 1\n---\n["set", [], "counter", 2]\n---\n["batch", [["set", [], "counter", 3]',
+            encoding="utf-8",
+        )
+        with PersistedState(self.filepath) as state:
+            assert state.counter == 2
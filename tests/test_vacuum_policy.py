@@ -0,0 +1,47 @@
+import pathlib
+
+from persistedstate import PersistedState, VacuumPolicy
+
+
+class TestVacuumPolicy:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/vacuum_policy.state")
+        self.filepath.unlink(missing_ok=True)
+
+    def journal(self):
+        return self.filepath.read_text(encoding="utf-8").split("\n---\n")[1:]
+
+    def test_min_journal_bytes(self):
+        policy = VacuumPolicy(min_journal_bytes=1000)
+        with PersistedState(self.filepath, _vacuum_policy=policy, counter=0) as state:
+            for _ in range(1000):
+                state.counter += 1
+                assert self.filepath.stat().st_size < 1100
+
+    def test_journal_ratio(self):
+        policy = VacuumPolicy(journal_ratio=0.5, min_journal_bytes=0)
+        with PersistedState(self.filepath, _vacuum_policy=policy, counter=0) as state:
+            state.entries = [f"item #{index}" for index in range(100)]
+            state.vacuum()
+            snapshot_size = self.filepath.stat().st_size
+            for _ in range(1000):
+                state.counter += 1
+                assert self.filepath.stat().st_size < snapshot_size * 1.6
+
+    def test_replay_budget(self):
+        policy = VacuumPolicy(
+            min_journal_bytes=1_000_000, replay_budget_milliseconds=0.05
+        )
+        with PersistedState(self.filepath, _vacuum_policy=policy, counter=0) as state:
+            for _ in range(100):
+                state.counter += 1
+                assert len(self.journal()) <= 5
+
+    def test_no_background_vacuum_by_default(self):
+        policy = VacuumPolicy(min_journal_bytes=100)
+        with PersistedState(self.filepath, _vacuum_policy=policy, counter=0) as state:
+            for _ in range(10):
+                with state.transaction():
+                    state.counter += 1
+                file_handler = state._MappedYaml__file_handler
+                assert file_handler._FileHandler__vacuum_thread is None
@@ -0,0 +1,70 @@
+import pathlib
+import time
+
+from persistedstate import PersistedState, WriteBehind
+
+
+class TestWriteBehind:
+    def setup_method(self) -> None:
+        self.filepath = pathlib.Path("tmp/write_behind.state")
+        self.filepath.unlink(missing_ok=True)
+
+    def journal(self):
+        return self.filepath.read_text(encoding="utf-8").split("\n---\n")[1:]
+
+    def reopen(self):
+        copy = self.filepath.with_suffix(".copy")
+        copy.write_text(self.filepath.read_text(encoding="utf-8"), encoding="utf-8")
+        return PersistedState(copy)
+
+    def test_coalescing(self):
+        with PersistedState(
+            self.filepath, _write_behind=WriteBehind(milliseconds=10_000), counter=0
+        ) as state:
+            state.vacuum()
+            for _ in range(100):
+                state.counter += 1
+            assert not self.journal()
+            state.flush()
+            assert self.journal() == ['["set", [], "counter", 100]']
+            with self.reopen() as copy:
+                assert copy.counter == 100
+
+    def test_operations_limit(self):
+        with PersistedState(
+            self.filepath,
+            _write_behind=WriteBehind(milliseconds=10_000, operations=3),
+            counter=0,
+        ) as state:
+            state.vacuum()
+            for index in range(4):
+                state[f"key{index}"] = index
+            assert len(self.journal()) == 3
+
+    def test_delay(self):
+        with PersistedState(
+            self.filepath, _write_behind=WriteBehind(milliseconds=10), counter=0
+        ) as state:
+            state.vacuum()
+            state.counter = 1
+            time.sleep(0.2)
+            assert self.journal() == ['["set", [], "counter", 1]']
+
+    def test_structural_changes(self):
+        with PersistedState(
+            self.filepath, _write_behind=WriteBehind(milliseconds=10_000)
+        ) as state:
+            state.vacuum()
+            state.top = {"a": 1}
+            state.top["a"] = 2
+            state.top = {"b": 1}
+            state.top["b"] = 2
+            state.list = [1]
+            state.list.insert(0, 0)
+            state.list[0] = 10
+            del state.list[1]
+            state.list[0] = 20
+            state.flush()
+            with self.reopen() as copy:
+                assert dict(copy.top) == {"b": 2}
+                assert list(copy.list) == [20]